@@ -0,0 +1,189 @@
+"""
+CARPS command-line frontend
+
+Parses the arguments and runs a single project or a batch with the core engine. The window
+frontend is imported only when no project name or manifest is given.
+"""
+
+
+import argparse
+import os
+import signal
+import sys
+
+from carps_core import (LAYOUTS, SCAFFOLD_MODES, STARTUP_RUNS, STARTUP_VARIANTS, TEST_PARTITIONS, CommandFailedError, build_cache_settings, check_preflight, configure_build_cache, configure_nuget_cache,
+                        console_execute_dotnet_commands, get_dotnet_environment, get_layout_projects, make_json_event_writer, nuget_settings, output_settings,
+                        print_batch_report, print_build_cache_summary, print_dotnet_environment, print_nuget_cache_summary, prune_build_cache, prune_nuget_cache,
+                        read_batch_manifest, run_batch, scheduler_settings, seed_nuget_feed, startup_settings, test_settings, validate_project_name, write_batch_report, write_metrics_exports)
+
+
+greeting_text = """
+C# Automated Rapid Project Setup (CARPS)
+Welcome to CARPS!
+This application helps you set up a new .NET project.
+It will:
+- Create a new directory for your project,
+- Initialize a new solution,
+- Create a new console application,
+- Add the application to the solution,
+- Build the application, and run it.
+Please ensure that .NET SDK are installed.
+Let's get started!\n
+"""
+
+def greeting():
+    print(greeting_text)
+
+def get_project_name():
+    project_name = input("Enter the name of the project: ")
+    return project_name
+
+def stop_on_terminate(signum, frame):
+    # Commands run in their own process groups and would outlive CARPS; unwinding cancels every step (and kills its commands) as Ctrl-C does
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description="Set up a new .NET project.")
+    parser.add_argument("project_name", nargs='?', default=None, help="The name of the project to create.")
+    parser.add_argument("--batch", metavar="MANIFEST", help="Scaffold every project listed in a CSV, JSON or TOML manifest.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of projects to scaffold in parallel in batch mode (default: CPU count).")
+    parser.add_argument("--report", metavar="PATH", help="Write the batch success/failure report to a JSON file.")
+    parser.add_argument("--log-dir", metavar="DIR", help="Also write each project's command output to DIR/<project>.log.")
+    parser.add_argument("--step-timeout", type=float, default=None, metavar="SECONDS", help="Stop a step that runs longer than this many seconds.")
+    parser.add_argument("--metrics", metavar="PATH", help="Write per-step wall time, CPU time and peak memory to a JSON file.")
+    parser.add_argument("--trace", metavar="PATH", help="Write a Chrome trace-event file of the steps (open it in chrome://tracing or Perfetto).")
+    parser.add_argument("--force", action="store_true", help="Re-run every step even if the project's journal says it is up to date.")
+    parser.add_argument("--template", default="console", help="The dotnet template used for the project (default: console).")
+    parser.add_argument("--framework", default=None, help="The target framework passed to the template, e.g. net8.0.")
+    parser.add_argument("--scaffold", choices=SCAFFOLD_MODES, default="dotnet",
+                        help="How project files are created: 'dotnet' runs dotnet new, 'cache' clones a cached golden template, "
+                             "'native' writes the files directly (console and classlib templates).")
+    parser.add_argument("--layout", metavar="LAYOUT",
+                        help=f"Create several projects in the solution, with references between them: {', '.join(LAYOUTS)}, or a JSON/TOML layout file.")
+    parser.add_argument("--max-builds", type=int, metavar="N",
+                        help="Run at most N builds at once (default: from the available cores and memory). Scaffolding steps are not limited.")
+    parser.add_argument("--nuget-cache", action="store_true", help="Restore into CARPS's shared NuGet packages folder and copy new packages into its offline feed.")
+    parser.add_argument("--offline", action="store_true", help="Restore only from CARPS's local offline feed (implies --nuget-cache).")
+    parser.add_argument("--seed-feed", metavar="DIR", help="Copy the packages in a NuGet packages folder or folder feed (e.g. ~/.nuget/packages) into the offline feed.")
+    parser.add_argument("--packages-limit", type=float, metavar="MIB", help="Afterwards, remove the least recently used packages from the shared packages folder until it is this small.")
+    parser.add_argument("--build-cache", action="store_true", help="Restore bin/obj from CARPS's build output cache when the sources, SDK and options match an earlier build.")
+    parser.add_argument("--build-cache-limit", type=float, metavar="MIB", help="Keep the build output cache under this size by evicting the least recently used builds (default: 2048).")
+    parser.add_argument("--no-build", action="store_true", help="Only create the solution and project files; do not build or run them.")
+    parser.add_argument("--tests", action="store_true", help="Run the solution's test projects after the build, adding an xunit project if it has none.")
+    parser.add_argument("--test-shards", type=int, metavar="N", help="Split each test project's run into N parallel dotnet test runs (default: from the cores and past timings).")
+    parser.add_argument("--test-partition", choices=TEST_PARTITIONS, default="class", help="Split the tests between shards by class (default) or by test method.")
+    parser.add_argument("--startup", action="store_true", help="Publish the app in several deployment modes and compare their launch time, peak memory and size.")
+    parser.add_argument("--startup-variants", default=",".join(STARTUP_VARIANTS), metavar="LIST",
+                        help=f"Comma-separated deployment modes for --startup, from {', '.join(STARTUP_VARIANTS)} (default: all).")
+    parser.add_argument("--startup-runs", type=int, default=STARTUP_RUNS, metavar="N", help=f"Launches of each published variant for --startup (default: {STARTUP_RUNS}).")
+    parser.add_argument("--no-run", action="store_true", help="Build the project but do not run it.")
+    parser.add_argument("--watch", action="store_true", help="Afterwards, keep watching the project and rebuild (and re-run) it once each burst of file changes settles.")
+    parser.add_argument("--queue", metavar="DIR", help="With --batch, queue the projects in DIR (on a shared filesystem) for --worker processes instead of running them here.")
+    parser.add_argument("--worker", action="store_true", help="Run the projects queued in --queue DIR, --jobs at a time, until stopped.")
+    parser.add_argument("--drain", action="store_true", help="With --worker, stop once the queue is empty.")
+    parser.add_argument("--daemon", action="store_true", help="Run as a daemon that scaffolds jobs from carps_client.py on a localhost port, with warm workers.")
+    parser.add_argument("--port", type=int, default=0, help="Port for --daemon (default: any free port; clients find it through the CARPS cache).")
+    parser.add_argument("--quiet", action="store_true", help="Do not echo command output; builds write an MSBuild binary log instead, shown if they fail.")
+    parser.add_argument("--json", action="store_true", help="Write JSON-lines events (steps, exit codes, durations, outputs) to stdout and everything else to stderr. Implies --quiet.")
+    parser.add_argument("--preflight", action="store_true", help="Only check that dotnet, the SDK, the template and the framework are usable, and show the SDK details.")
+    args = parser.parse_args()
+    if args.watch and (args.project_name is None or args.batch is not None or args.daemon):
+        parser.error("--watch needs a single project name")
+    if args.worker != (args.queue is not None and args.batch is None):
+        parser.error("use --queue DIR with either --batch or --worker")
+    startup_variants = [variant.strip() for variant in args.startup_variants.split(",") if variant.strip()]
+    if not startup_variants or any(variant not in STARTUP_VARIANTS for variant in startup_variants):
+        parser.error(f"--startup-variants takes a comma-separated list of {', '.join(STARTUP_VARIANTS)}")
+    if args.startup_runs < 1:
+        parser.error("--startup-runs must be at least 1")
+
+    signal.signal(signal.SIGTERM, stop_on_terminate)
+    event_callback = None
+    if args.json:
+        event_callback = make_json_event_writer(sys.stdout)
+        sys.stdout = sys.stderr  # Messages for people go to stderr, so stdout carries nothing but events
+    if args.quiet or args.json:
+        output_settings.update(echo=False, binary_logs=True)
+    scheduler_settings["max_heavy_steps"] = args.max_builds
+    test_settings.update(enabled=args.tests, shards=args.test_shards, partition=args.test_partition)
+    startup_settings.update(enabled=args.startup, variants=startup_variants, runs=args.startup_runs)
+
+    if args.preflight:
+        try:
+            dotnet_environment = get_dotnet_environment()
+            print_dotnet_environment(dotnet_environment)
+            check_preflight(dotnet_environment, args.template, args.framework)
+        except CommandFailedError as e:
+            raise SystemExit(str(e))
+        print(f"Ready to create {args.template} projects.")
+        return
+
+    build_cache_maintenance = args.build_cache_limit is not None and args.project_name is None and args.batch is None
+    if args.build_cache or args.build_cache_limit is not None:
+        configure_build_cache(args.build_cache_limit * 1024 * 1024 if args.build_cache_limit is not None else None)
+
+    nuget_maintenance = args.seed_feed is not None or args.packages_limit is not None
+    if args.nuget_cache or args.offline or nuget_maintenance:
+        configure_nuget_cache(args.offline)
+        if args.seed_feed is not None:
+            try:
+                seed_nuget_feed(os.path.expanduser(args.seed_feed))
+            except CommandFailedError as e:
+                raise SystemExit(str(e))
+
+    if args.daemon:
+        import carps_daemon  # Deferred like the window: only the daemon needs the HTTP server
+        carps_daemon.run_daemon(args.port, args.jobs, args.template, args.framework, args.scaffold, args.log_dir, args.step_timeout)
+    elif args.worker:
+        import carps_queue  # Deferred like the daemon
+        carps_queue.run_queue_worker(args.queue, args.jobs, args.log_dir, args.step_timeout, args.drain)
+    elif args.batch is not None:
+        # Batch version
+        if output_settings["echo"]:
+            greeting()
+        projects = read_batch_manifest(args.batch, args.template, args.framework, args.scaffold, args.layout)
+        if args.queue is not None:
+            import carps_queue
+            results = carps_queue.run_queued_batch(projects, args.queue, args.force, event_callback)
+        else:
+            results = run_batch(projects, args.jobs, args.log_dir, args.step_timeout, args.force, event_callback)
+        print_batch_report(results)
+        if event_callback is not None:
+            event_callback({"type": "batch-finish", "total": len(results), "failed": [{"name": result["name"], "error": result["error"]} for result in results if result["status"] != "succeeded"]})
+        if args.report:
+            write_batch_report(results, args.report)
+        write_metrics_exports([result["metrics"] for result in results if result["metrics"]], args.metrics, args.trace)
+        failed = sum(1 for result in results if result["status"] != "succeeded")
+        if failed:
+            raise SystemExit(f"{failed} of {len(results)} projects failed.")
+    elif args.project_name is not None:
+        # Command-line version
+        if output_settings["echo"]:
+            greeting()
+        try:
+            validate_project_name(args.project_name)
+            get_layout_projects(args.project_name, args.layout, args.template)
+        except ValueError as e:  # A bad name or layout file, such as one with a reference cycle
+            raise SystemExit(str(e))
+        project_metrics = {}
+        try:
+            console_execute_dotnet_commands(args.project_name, template=args.template, framework=args.framework, log_directory=args.log_dir, scaffold=args.scaffold,
+                                            step_timeout=args.step_timeout, project_metrics=project_metrics, force=args.force, layout=args.layout, event_callback=event_callback,
+                                            build=not args.no_build, run=not args.no_run, watch=args.watch)
+        finally:
+            if project_metrics:
+                write_metrics_exports([project_metrics], args.metrics, args.trace)
+    elif not nuget_maintenance and not build_cache_maintenance:
+        import carps_gui  # Deferred: tkinter is slow to import and may not be installed on build machines
+        carps_gui.main()
+
+    if nuget_settings["enabled"]:
+        if args.packages_limit is not None:
+            removed_count, _ = prune_nuget_cache(args.packages_limit * 1024 * 1024)
+            print(f"Removed {removed_count} least recently used packages from the shared packages folder")
+        print_nuget_cache_summary()
+    if build_cache_settings["enabled"]:
+        if build_cache_maintenance:  # Builds prune the cache as they store into it
+            removed_count, _ = prune_build_cache(build_cache_settings["size_limit"])
+            print(f"Removed {removed_count} least recently used builds from the build cache")
+        print_build_cache_summary()
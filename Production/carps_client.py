@@ -0,0 +1,123 @@
+"""
+CARPS thin client
+
+Sends a project to a running CARPS daemon (python CARPS.py --daemon) and waits for the result.
+It imports nothing from CARPS itself, so it starts in a few milliseconds and the daemon's warm
+workers do all the work.
+
+Usage: python carps_client.py MyProject [--template T] [--framework F] [--scaffold MODE] [--no-build]
+"""
+
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+
+JOB_WAIT_SECONDS = 30  # Each status request waits up to this long for the job to finish
+
+def get_daemon_state_path():
+    # Same folder as get_carps_cache_directory in carps_core, repeated here so the client does not import the engine
+    if os.environ.get("CARPS_CACHE_DIR"):
+        cache_directory = os.environ["CARPS_CACHE_DIR"]
+    elif os.name == "nt":
+        cache_directory = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "CARPS", "cache")
+    else:
+        cache_directory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "carps")
+    return os.path.join(cache_directory, "daemon.json")
+
+def read_daemon_state():
+    try:
+        with open(get_daemon_state_path(), encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        raise SystemExit("No CARPS daemon is running. Start one with: python CARPS.py --daemon")
+
+def send_request(daemon_state, method, path, body=None, timeout=None):
+    connection = http.client.HTTPConnection(daemon_state["host"], daemon_state["port"], timeout=timeout)
+    try:
+        connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                           headers={"Authorization": f"Bearer {daemon_state['token']}", "Content-Type": "application/json"})
+        response = connection.getresponse()
+        result = json.loads(response.read() or b"{}")
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not reach the CARPS daemon at {daemon_state['host']}:{daemon_state['port']}: {e}")
+    finally:
+        connection.close()
+    if response.status >= 400:
+        raise SystemExit(f"The CARPS daemon refused the request: {result.get('error')}")
+    return result
+
+def print_json_event(event):
+    # The same JSON lines as CARPS.py --json, so CI tools can read either
+    print(json.dumps(event, separators=(",", ":")), flush=True)
+
+def wait_for_job(daemon_state, job, event_callback=None):
+    printed_event_count = 0
+    while True:
+        if event_callback is not None:
+            for event in job["events"][printed_event_count:]:  # Each poll passes on the events since the last one
+                event_callback(event)
+            printed_event_count = len(job["events"])
+        if job["status"] not in ("queued", "running"):
+            return job
+        job = send_request(daemon_state, "GET", f"/jobs/{job['id']}?wait={JOB_WAIT_SECONDS}", timeout=JOB_WAIT_SECONDS + 30)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaffold a .NET project with a running CARPS daemon.")
+    parser.add_argument("project_name", nargs="?", default=None, help="The name of the project to create.")
+    parser.add_argument("--directory", default=None, help="Folder to create the project in (default: the current folder).")
+    parser.add_argument("--template", default=None, help="The dotnet template (default: the daemon's).")
+    parser.add_argument("--framework", default=None, help="The target framework (default: the daemon's).")
+    parser.add_argument("--scaffold", default=None, help="dotnet, cache or native (default: the daemon's).")
+    parser.add_argument("--layout", default=None, help="A layout preset or an absolute path to a layout file.")
+    parser.add_argument("--force", action="store_true", help="Re-run every step even if the project's journal says it is up to date.")
+    parser.add_argument("--no-build", action="store_true", help="Only create the solution and project files.")
+    parser.add_argument("--no-wait", action="store_true", help="Print the job ID and return without waiting.")
+    parser.add_argument("--json", action="store_true", help="Print the job's events as JSON lines, like CARPS.py --json, ending with a job-finish event.")
+    parser.add_argument("--status", action="store_true", help="Show the daemon's workers and queue.")
+    parser.add_argument("--cancel", metavar="JOB_ID", help="Cancel a queued or running job.")
+    parser.add_argument("--shutdown", action="store_true", help="Stop the daemon.")
+    args = parser.parse_args()
+
+    daemon_state = read_daemon_state()
+    if args.status:
+        print(json.dumps(send_request(daemon_state, "GET", "/status"), indent=2))
+        return
+    if args.cancel:
+        print(f"Job {args.cancel}: {send_request(daemon_state, 'DELETE', f'/jobs/{args.cancel}')['status']}")
+        return
+    if args.shutdown:
+        send_request(daemon_state, "POST", "/shutdown")
+        print("CARPS daemon is stopping")
+        return
+    if args.project_name is None:
+        parser.error("a project name is required")
+
+    layout = args.layout
+    if layout is not None and os.path.exists(layout):
+        layout = os.path.abspath(layout)  # The daemon resolves paths from its own folder
+    job = send_request(daemon_state, "POST", "/jobs", {"name": args.project_name, "directory": os.path.abspath(args.directory or os.getcwd()),
+                                                       "template": args.template, "framework": args.framework, "scaffold": args.scaffold, "layout": layout,
+                                                       "force": args.force, "build": not args.no_build})
+    if args.no_wait:
+        print(job["id"])
+        return
+
+    job = wait_for_job(daemon_state, job, print_json_event if args.json else None)
+    if args.json:
+        print_json_event({"type": "job-finish", "id": job["id"], "project": args.project_name, "status": job["status"], "duration": job["duration"],
+                          "error": job["error"], "directory": job["directory"], "time": round(time.time(), 3)})
+    else:
+        for event in job["events"]:
+            if event["type"] == "step-failed":
+                print(f"Step '{event['step']}' failed: {event['error']}" + (f" (build log: {event['binary_log']})" if "binary_log" in event else ""))
+        duration_text = f" in {job['duration']:.2f}s" if job["duration"] is not None else ""  # A job cancelled before it started never ran
+        print(f"{args.project_name}: {job['status']}{duration_text}" + (f" ({job['directory']})" if job["directory"] else ""))
+    if job["status"] != "succeeded":
+        sys.exit(job["error"] or f"Job {job['status']}.")
+
+if __name__ == "__main__":
+    main()
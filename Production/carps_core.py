@@ -0,0 +1,2343 @@
+"""
+CARPS core engine
+
+Everything that scaffolds, builds and measures projects: the asyncio command runner, the step graph,
+the golden-template cache, the native generator, the build output cache, the step journal, instrumentation, batch mode and watch mode.
+It never imports a frontend, so the command line and scripts can use it without tkinter.
+"""
+
+
+import os
+import sys
+import platform
+import asyncio
+import shlex
+import signal
+import subprocess
+import re
+import csv
+import json
+import hashlib
+import shutil
+import tempfile
+import uuid
+import zipfile
+import base64
+import contextvars
+import time
+import statistics
+import threading
+import html
+from collections import deque
+from xml.etree import ElementTree
+
+try:
+    import tomllib  # Python 3.11+
+except ImportError:
+    tomllib = None
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # Optional: more accurate process-tree sampling, and CPU/memory figures on Windows
+except ImportError:
+    psutil = None
+
+template_cache_lock = threading.Lock()  # Only one batch worker scaffolds a missing golden template
+command_usage_lock = threading.Lock()
+running_command_count = 0  # Children rusage can only be attributed to a command that ran alone
+current_step_metrics = contextvars.ContextVar("current_step_metrics", default=None)  # Commands add their usage to the step running them
+command_environment = {}  # Extra environment variables for every dotnet command CARPS starts
+nuget_settings = {"enabled": False, "offline": False}  # Set by configure_nuget_cache
+nuget_usage_lock = threading.Lock()
+dotnet_environment_cache = {}  # Probe results already loaded by this process, by probe cache key
+dotnet_environment_lock = threading.Lock()
+heavy_step_scheduler = contextvars.ContextVar("heavy_step_scheduler", default=None)  # Shared by every project of one run or batch
+scheduler_settings = {"max_heavy_steps": None}  # Set from --max-builds
+output_settings = {"echo": True, "binary_logs": False}  # Set from --quiet and --json
+build_cache_settings = {"enabled": False}  # Set by configure_build_cache
+build_cache_statistics = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+build_cache_lock = threading.Lock()
+test_settings = {"enabled": False, "shards": None, "partition": "class"}  # Set from --tests, --test-shards and --test-partition
+startup_settings = {"enabled": False, "variants": None, "runs": None}  # Set from --startup, --startup-variants and --startup-runs
+
+OUTPUT_TAIL_LINES = 50  # Lines of command output kept for the failure summary
+OUTPUT_LINE_LIMIT = 1024 * 1024  # Longest single output line read from a command, in bytes
+COMMAND_EXIT_POLL_INTERVAL = 0.1  # Seconds between checks whether a command has exited while its output is still open
+OUTPUT_DRAIN_TIMEOUT = 5.0  # Seconds to wait for the rest of a command's output once it has exited, before stopping children that hold it open
+STEP_TIMEOUT = 900  # Seconds a step may run unless it sets its own budget: room for a cold restore and build, but a deadlocked build is reclaimed
+RUN_STEP_TIMEOUT = 120  # Seconds the smoke run of the built app may take
+PROBE_TIMEOUT = 120  # Seconds each dotnet command of the environment probe may take
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between checks for a cancel request from another thread
+JOURNAL_DIRECTORY = ".carps"  # Per-project state kept next to the solution
+JOURNAL_FILE = "journal.json"
+JOURNAL_VERSION = 1
+JOURNAL_IGNORED_DIRECTORIES = ("bin", "obj", JOURNAL_DIRECTORY)
+WATCH_POLL_INTERVAL = 0.25  # Seconds between scans of a watched project tree
+WATCH_DEBOUNCE = 0.5  # Seconds without further changes before a burst of changes triggers a rebuild
+WATCH_IGNORED_DIRECTORIES = JOURNAL_IGNORED_DIRECTORIES + (".git", ".vs", ".vscode", ".idea", "TestResults")  # Pruned at every depth: builds and tools write there
+WATCH_IGNORED_SUFFIXES = ("~", ".swp", ".swx", ".tmp")  # Editor backup and swap files
+WATCH_REPORTED_PATHS = 5  # Changed files named in a rebuild message
+WATCH_RECOVERABLE_STEPS = ("build", "run", "test", "startup")  # Steps whose failures an edit can fix, so watch mode keeps going after them
+BINARY_LOG_DIRECTORY = "logs"  # MSBuild binary logs of a project's builds, inside its journal directory
+USAGE_SAMPLE_INTERVAL = 0.2  # Seconds between CPU/memory samples of a running command's process tree
+TEMPLATE_PLACEHOLDER_NAME = "CarpsGoldenTemplate"  # Project name used for golden copies in the template cache
+TEMPLATE_METADATA_FILE = "carps-template.json"
+TEMPLATE_TEXT_EXTENSIONS = (".sln", ".csproj", ".cs", ".json", ".props", ".targets", ".config", ".md")
+SCAFFOLD_MODES = ("dotnet", "cache", "native")
+NATIVE_PROJECT_TEMPLATES = ("console", "classlib")  # Templates the native generator can write without dotnet new
+LIBRARY_TEMPLATES = ("classlib", "razorclasslib", "xunit", "nunit", "mstest")
+TEST_TEMPLATES = ("xunit", "nunit", "mstest")
+TEST_PROJECT_TEMPLATE = "xunit"  # Template of the test project --tests adds to a solution that has none
+TEST_PARTITIONS = ("class", "method")
+TEST_DIRECTORY = "tests"  # Per test project, inside the journal directory: shard results and the timing history
+TEST_SHARD_DIRECTORY = "shards"
+TEST_TIMINGS_FILE = "timings.json"
+TEST_TIMINGS_VERSION = 1
+TEST_RESULTS_DIRECTORY = "TestResults"  # Merged reports, next to the solution like dotnet test's own results
+TEST_SHARD_CORES = 2  # Cores one test host keeps busy; xunit already runs test classes in parallel inside it
+TEST_SHARD_MIN_DURATION = 5.0  # Seconds of past test time below which one test host is faster than starting several
+TEST_FILTER_LENGTH_LIMIT = 8000  # Longest --filter a shard may get; Windows allows 32,767 characters for the whole command line
+TRX_NAMESPACE = "http://microsoft.com/schemas/VisualStudio/TeamTest/2010"
+TRX_FAILED_OUTCOMES = ("Failed", "Error", "Timeout", "Aborted")
+STARTUP_VARIANTS = {
+    # dotnet publish options of each deployment mode; all but the framework-dependent one also get the runtime identifier
+    "fdd": [],
+    "scd": ["--self-contained", "true"],
+    "r2r": ["--self-contained", "true", "-p:PublishReadyToRun=true"],
+    "trimmed": ["--self-contained", "true", "-p:PublishTrimmed=true"],
+    "aot": ["-p:PublishAot=true"],
+}
+STARTUP_RUNS = 5  # Launches of each published variant: the first is the cold start, the median of the rest the warm start
+STARTUP_DIRECTORY = "startup"  # Published variants and the comparison report, inside the journal directory
+STARTUP_VARIANT_TIMEOUT = 600  # Seconds one variant's publish and launches may take; the startup step gets one more of these than it has variants
+LAYOUTS = {
+    # {name} is replaced with the solution name; projects without a template use --template
+    "app-lib-tests": [
+        {"name": "{name}", "template": "console", "references": ["{name}.Core"]},
+        {"name": "{name}.Core", "template": "classlib"},
+        {"name": "{name}.Tests", "template": "xunit", "references": ["{name}.Core"]},
+    ],
+}
+DOTNET_ENVIRONMENT_DEFAULTS = {
+    "DOTNET_SKIP_FIRST_TIME_EXPERIENCE": "1",
+    "DOTNET_NOLOGO": "1",
+    "DOTNET_CLI_TELEMETRY_OPTOUT": "1",  # Otherwise every command queues a telemetry upload
+    "DOTNET_GENERATE_ASPNET_CERTIFICATE": "false",  # The first command would otherwise create an HTTPS development certificate
+    "DOTNET_CLI_WORKLOAD_UPDATE_NOTIFY_DISABLE": "1",  # Skips the background check for workload updates
+}
+PROBE_CACHE_VERSION = 1
+HEAVY_STEP_CORES = 2  # Cores one build keeps busy; with more cores, more builds run at once instead
+HEAVY_STEP_MEMORY = 768 * 1024 * 1024  # Memory one build needs with its MSBuild node and its share of the compiler server
+MEMORY_RECHECK_INTERVAL = 1.0  # Seconds between memory checks while a build waits for memory another process may free
+MSBUILD_COMMANDS = ("build", "test", "publish", "pack", "msbuild", "restore")
+NUGET_CONFIG_FILE = "nuget.config"
+NUGET_CONFIG_MARKER = "Generated by CARPS for offline restore"  # Only nuget.config files with this comment are ever replaced or removed
+NUGET_USAGE_FILE = "usage.json"  # Last restore time of each package in the shared packages folder, for LRU pruning
+CSHARP_PROJECT_TYPE_GUID = "FAE04EC0-301F-11D3-BF4B-00C04F79EFBC"
+SOLUTION_CONFIGURATIONS = ("Debug", "Release")
+BUILD_CACHE_VERSION = 1
+BUILD_CACHE_ENTRY_FILE = "carps-build.json"
+BUILD_CACHE_SIZE_LIMIT = 2048 * 1024 * 1024  # Default cap on the build output cache; least recently used builds are evicted beyond it
+BUILD_CACHE_TEXT_LIMIT = 4 * 1024 * 1024  # Larger build outputs are never text files that name the solution folder
+BUILD_CACHE_ROOT_TOKENS = ("@CarpsBuildRootJson@", "@CarpsBuildRoot@")  # Stand in for the solution folder in cached text outputs
+
+class CommandFailedError(Exception):
+    # Raised inside the engine instead of SystemExit, which asyncio would re-raise straight out of the event loop
+    pass
+
+def validate_project_name(project_name):
+    if not project_name or not re.match("^[A-Za-z0-9_ ]+$", project_name):
+        raise ValueError("Invalid project name. Project name must be non-empty and can only contain alphanumeric characters, underscores, and spaces.")
+
+def read_structured_file(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".csv":
+        with open(file_path, newline="", encoding="utf-8") as structured_file:
+            return list(csv.DictReader(structured_file))
+    if extension == ".json":
+        with open(file_path, encoding="utf-8") as structured_file:
+            return json.load(structured_file)
+    if extension == ".toml":
+        if tomllib is None:
+            raise ValueError("TOML files require Python 3.11 or newer.")
+        with open(file_path, "rb") as structured_file:
+            return tomllib.load(structured_file)
+    raise ValueError(f"Unsupported file format '{extension}'. Use a .csv, .json or .toml file.")
+
+def get_layout_projects(project_name, layout=None, default_template="console"):
+    # A layout is the name of a built-in layout or a JSON/TOML file with the same shape ({"projects": [...]})
+    if layout is None:
+        return None
+    if layout in LAYOUTS:
+        entries = LAYOUTS[layout]
+    elif os.path.isfile(layout):
+        entries = read_structured_file(layout)
+        entries = entries.get("projects", []) if isinstance(entries, dict) else entries
+    else:
+        raise ValueError(f"Unknown layout '{layout}'. Use one of {', '.join(LAYOUTS)} or the path of a layout file.")
+
+    layout_projects = []
+    for entry in entries:
+        layout_project_name = (entry.get("name") or "").replace("{name}", project_name).strip()
+        # Layout project names may also contain dots, as in MyApp.Core
+        if not re.match(r"^[A-Za-z0-9_ ]+(\.[A-Za-z0-9_ ]+)*$", layout_project_name):
+            raise ValueError(f"Invalid project name '{layout_project_name}' in layout '{layout}'.")
+        layout_projects.append({"name": layout_project_name, "template": entry.get("template") or default_template,
+                                "references": [reference.replace("{name}", project_name) for reference in entry.get("references", [])]})
+
+    project_names = [layout_project["name"] for layout_project in layout_projects]
+    if not layout_projects or len(set(project_names)) != len(project_names):
+        raise ValueError(f"Layout '{layout}' must list at least one project, each with a different name.")
+    for layout_project in layout_projects:
+        for reference in layout_project["references"]:
+            if reference not in project_names or reference == layout_project["name"]:
+                raise ValueError(f"Project '{layout_project['name']}' in layout '{layout}' references unknown project '{reference}'.")
+
+    # MSBuild would only report a cycle deep inside the build, so it is refused here with the projects involved
+    references = {layout_project["name"]: layout_project["references"] for layout_project in layout_projects}
+    visit_states = {}
+    def find_reference_cycle(name, path):
+        visit_states[name] = "visiting"
+        for reference in references[name]:
+            if visit_states.get(reference) == "visiting":
+                return path[path.index(reference):] + [reference]
+            if reference not in visit_states:
+                cycle = find_reference_cycle(reference, path + [reference])
+                if cycle:
+                    return cycle
+        visit_states[name] = "done"
+        return None
+
+    for name in project_names:
+        cycle = find_reference_cycle(name, [name]) if name not in visit_states else None
+        if cycle:
+            raise ValueError(f"Layout '{layout}' has a reference cycle: {' -> '.join(cycle)}.")
+    return layout_projects
+
+def format_command(command):
+    return subprocess.list2cmdline(command) if os.name == "nt" else shlex.join(command)
+
+def get_process_group_options():
+    # Each command leads its own process group, so its whole tree can be killed at once and Ctrl-C reaches only CARPS, which then stops it
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+def kill_process_tree(process):
+    # MSBuild nodes, the compiler server and the launched app are children of the command; killing only the command would leave them running
+    if os.name == "nt":
+        # taskkill /T follows parent process IDs, so it only finds the tree while the command itself is alive
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        return
+
+    descendant_pids = [pid for pid in read_process_tree_usage(process.pid) if pid != process.pid] if process.returncode is None else []
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    for pid in descendant_pids:  # Children that started a session of their own are no longer in the command's group
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+async def execute_single_command(command, log_prefix="", output_callback=None, log_file=None):
+    # The command is an argument list started without a shell, so names with spaces need no quoting
+    display_command = format_command(command)
+    if output_settings["echo"]:
+        print(f"{log_prefix}Executing command: {display_command}")
+    if log_file is not None:
+        log_file.write(f"$ {display_command}\n")
+
+    # Only the last few lines are kept for the failure summary; everything else is streamed through
+    output_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    # No command reads input, so a prompt fails instead of waiting forever; its own process group lets the watchdog kill its whole tree
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                   limit=OUTPUT_LINE_LIMIT, env=get_command_environment(), **get_process_group_options())
+    # Counted only once the command exists, so a failed spawn cannot leave the count raised; children rusage only grows when the command is reaped
+    usage_before = begin_command_usage()
+    sampled_usage = {"processes": {}, "peak_rss": 0}
+    sampler_task = asyncio.create_task(sample_command_usage(process, sampled_usage))
+    reader_task = asyncio.create_task(stream_command_output(process, output_tail, log_prefix, output_callback, log_file))
+    try:
+        # Process.wait() also waits for the output pipe to close, so the command's own exit is watched separately
+        while not reader_task.done() and process.returncode is None:
+            await asyncio.wait({reader_task}, timeout=COMMAND_EXIT_POLL_INTERVAL)
+        if not reader_task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(reader_task), OUTPUT_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                # A leftover child (an MSBuild node, the compiler server, something the app started) inherited the output pipe and keeps it open
+                print(f"{log_prefix}Command exited but its child processes kept running; stopping them")
+        if reader_task.done():
+            await process.wait()
+    finally:
+        if process.returncode is None or not reader_task.done():  # Cancelled or timed out: do not leave the command or anything it started running
+            was_running = process.returncode is None
+            kill_process_tree(process)
+            if was_running:
+                print(f"{log_prefix}Stopped command: {display_command}")
+                await process.wait()
+        reader_task.cancel()
+        await asyncio.gather(reader_task, return_exceptions=True)
+        sampler_task.cancel()
+        end_command_usage(usage_before, sampled_usage)
+
+    step_metrics = current_step_metrics.get()
+    if step_metrics is not None:
+        step_metrics["exit_code"] = process.returncode
+    if process.returncode != 0:
+        print(f"{log_prefix}Failed to execute command: {display_command} (exit code {process.returncode})")
+        print(f"{log_prefix}Last {len(output_tail)} lines of output:")
+        for line in output_tail:
+            print(f"{log_prefix}  {line}")
+        raise CommandFailedError("Stopping execution due to command failure.")
+    elif output_settings["echo"]:
+        print(f"{log_prefix}Successfully executed command: {display_command}")
+
+async def stream_command_output(process, output_tail, log_prefix="", output_callback=None, log_file=None):
+    while True:
+        try:
+            line = await process.stdout.readline()
+        except ValueError:
+            line = f"[output line longer than {OUTPUT_LINE_LIMIT} bytes dropped]\n".encode()
+        if not line:
+            break
+        line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+        output_tail.append(line)
+        if output_settings["echo"]:  # Quiet runs keep only the tail, for the failure summary
+            print(f"{log_prefix}{line}")
+        if log_file is not None:
+            log_file.write(line + "\n")
+        if output_callback is not None:
+            output_callback(line)
+
+def build_scaffold_commands(project_name, project_directory_path, template="console", framework=None, force=False):
+    solution_path = os.path.join(project_directory_path, f"{project_name}.sln")
+    project_path = os.path.join(project_directory_path, project_name, f"{project_name}.csproj")
+    framework_option = ["-f", framework] if framework else []
+    # Only the user's --force may overwrite files; without it dotnet new refuses, as it always has
+    force_option = ["--force"] if force else []
+
+    return [
+        ["dotnet", "new", "sln", "-n", project_name, "-o", project_directory_path] + force_option,
+        # The build restores anyway, so the template's own restore would be done twice
+        ["dotnet", "new", template, "-o", os.path.join(project_directory_path, project_name)] + framework_option + ["--no-restore"] + force_option,
+        ["dotnet", "sln", solution_path, "add", project_path]
+    ]
+
+def make_step(name, command=None, action=None, inputs=(), outputs=(), requires=(), skips=(), timeout=None, heavy=False, build_cache=None, keep_existing=False):
+    # A step runs either a dotnet command or an async Python action; the files it reads and writes decide its prerequisites.
+    # Heavy steps (builds and runs) wait for the resource scheduler; light steps such as dotnet new start right away.
+    # Build steps name their solution folder and project folders in build_cache, so their bin/obj output can come from the build cache.
+    # Scaffold steps that create files set keep_existing (unless --force), so they count as done when their outputs are already there.
+    return {"name": name, "command": command, "action": action, "inputs": list(inputs), "outputs": list(outputs), "requires": list(requires),
+            "skips": list(skips), "timeout": timeout, "heavy": heavy, "build_cache": build_cache, "keep_existing": keep_existing}
+
+def build_scaffold_steps(project_name, project_directory_path, template="console", framework=None, force=False):
+    solution_path = os.path.join(project_directory_path, f"{project_name}.sln")
+    project_path = os.path.join(project_directory_path, project_name, f"{project_name}.csproj")
+    new_solution_command, new_project_command, solution_add_command = build_scaffold_commands(project_name, project_directory_path, template, framework, force)
+
+    return [
+        make_step("new-sln", new_solution_command, outputs=[solution_path], keep_existing=not force),
+        make_step("new-project", new_project_command, outputs=[project_path], skips=["restore"], keep_existing=not force),
+        make_step("sln-add", solution_add_command, inputs=[solution_path, project_path], outputs=[solution_path]),
+    ]
+
+def find_built_assembly(project_path, configuration="Debug"):
+    try:
+        with open(project_path, encoding="utf-8-sig") as project_file:
+            project_text = project_file.read()
+    except OSError:
+        return None
+
+    # Only single-target projects have one obvious output; anything else is left to dotnet run
+    target_framework = re.search(r"<TargetFramework>\s*([^<\s]+)\s*</TargetFramework>", project_text)
+    assembly_name = re.search(r"<AssemblyName>\s*([^<]+?)\s*</AssemblyName>", project_text)
+    if target_framework is None or "$(" in target_framework.group(1):
+        return None
+
+    assembly_file_name = assembly_name.group(1) if assembly_name else os.path.splitext(os.path.basename(project_path))[0]
+    assembly_path = os.path.join(os.path.dirname(project_path), "bin", configuration, target_framework.group(1), f"{assembly_file_name}.dll")
+    return assembly_path if os.path.isfile(assembly_path) else None
+
+async def run_built_project(project_path, log_prefix="", log_file=None, output_callback=None):
+    # The build step just finished, so skip dotnet run's restore, build and MSBuild evaluation
+    assembly_path = find_built_assembly(project_path)
+    if assembly_path is not None:
+        await execute_single_command(["dotnet", assembly_path], log_prefix, output_callback, log_file)
+    else:
+        await execute_single_command(["dotnet", "run", "--no-build", "--project", project_path], log_prefix, output_callback, log_file)
+
+def build_run_steps(project_name, project_directory_path, template="console"):
+    project_path = os.path.join(project_directory_path, project_name, f"{project_name}.csproj")
+    build_output_path = os.path.join(project_directory_path, project_name, "bin")
+
+    source_directory_path = os.path.join(project_directory_path, project_name)
+
+    steps = [make_step("build", ["dotnet", "build", project_path], inputs=[project_path, source_directory_path], outputs=[build_output_path], heavy=True,
+                       build_cache={"root": project_directory_path, "projects": [source_directory_path]})]
+    if template not in LIBRARY_TEMPLATES:  # Libraries and test projects have nothing to run
+        steps.append(make_step("run", action=lambda log_prefix, log_file, output_callback: run_built_project(project_path, log_prefix, log_file, output_callback),
+                               inputs=[build_output_path], skips=["restore", "build", "MSBuild evaluation"], timeout=RUN_STEP_TIMEOUT, heavy=True))
+        if startup_settings["enabled"]:
+            steps.append(make_step("startup", action=lambda log_prefix, log_file, output_callback: measure_startup_variants(project_path, project_directory_path, log_prefix, log_file, output_callback),
+                                   inputs=[build_output_path], timeout=(len(startup_settings["variants"]) + 1) * STARTUP_VARIANT_TIMEOUT, heavy=True))
+    return steps
+
+def build_layout_steps(project_name, project_directory_path, layout_projects, framework=None, scaffold="dotnet", force=False):
+    solution_path = os.path.join(project_directory_path, f"{project_name}.sln")
+    project_paths = {project["name"]: os.path.join(project_directory_path, project["name"], f"{project['name']}.csproj") for project in layout_projects}
+    framework_option = ["-f", framework] if framework else []
+    force_option = ["--force"] if force else []
+
+    # Projects only depend on their own step, so they are all created at the same time
+    scaffold_steps = []
+    if scaffold not in ("native", "cache"):
+        scaffold_steps.append(make_step("new-sln", ["dotnet", "new", "sln", "-n", project_name, "-o", project_directory_path] + force_option, outputs=[solution_path], keep_existing=not force))
+    for project in layout_projects:
+        project_path = project_paths[project["name"]]
+        reference_paths = [project_paths[reference] for reference in project["references"]]
+        target_framework = get_native_target_framework(project["template"], framework, os.path.dirname(project_directory_path)) if scaffold == "native" else None
+        if target_framework is not None:
+            scaffold_steps.append(make_step(f"generate:{project['name']}", action=lambda log_prefix, log_file, output_callback, project=project, target_framework=target_framework, reference_paths=reference_paths:
+                                            asyncio.to_thread(generate_native_layout_project, project["name"], os.path.dirname(project_paths[project["name"]]), project["template"], target_framework, reference_paths, log_prefix, force),
+                                            outputs=[project_path], skips=["dotnet new", "dotnet add reference", "restore"], keep_existing=not force))
+        elif scaffold == "cache":
+            scaffold_steps.append(make_step(f"clone-template:{project['name']}", action=lambda log_prefix, log_file, output_callback, project=project, reference_paths=reference_paths:
+                                            asyncio.to_thread(scaffold_layout_project_from_template_cache, project["name"], os.path.dirname(project_paths[project["name"]]), project["template"], framework, reference_paths, log_prefix, log_file, force),
+                                            outputs=[project_path], skips=["dotnet new", "dotnet add reference", "restore"], keep_existing=not force))
+        else:
+            scaffold_steps.append(make_step(f"new-project:{project['name']}", ["dotnet", "new", project["template"], "-n", project["name"], "-o", os.path.dirname(project_path)] + framework_option + ["--no-restore"] + force_option,
+                                            outputs=[project_path], skips=["restore"], keep_existing=not force))
+            if reference_paths:
+                # One call adds all of a project's references; it runs once the referenced projects exist
+                scaffold_steps.append(make_step(f"add-references:{project['name']}", ["dotnet", "add", project_path, "reference"] + reference_paths,
+                                                inputs=[project_path] + reference_paths, outputs=[project_path]))
+
+    if scaffold in ("native", "cache"):  # The generated and cloned projects exist as files, so the solution is written directly too
+        solution_projects = [(project["name"], f"{project['name']}\\{project['name']}.csproj") for project in layout_projects]
+        scaffold_steps.append(make_step("generate-sln", action=lambda log_prefix, log_file, output_callback: asyncio.to_thread(generate_solution_file, solution_path, solution_projects, force),
+                                        outputs=[solution_path], skips=["dotnet new sln", "dotnet sln add"], keep_existing=not force))
+    else:
+        scaffold_steps.append(make_step("sln-add", ["dotnet", "sln", solution_path, "add"] + list(project_paths.values()), inputs=[solution_path] + list(project_paths.values()),
+                                        outputs=[solution_path], skips=[f"{len(project_paths) - 1} more dotnet sln add calls"] if len(project_paths) > 1 else []))
+
+    # One solution build: MSBuild builds the projects in parallel in reference order and shares evaluation between them
+    build_output_paths = {name: os.path.join(os.path.dirname(project_path), "bin") for name, project_path in project_paths.items()}
+    run_steps = [make_step("build", ["dotnet", "build", solution_path], inputs=[solution_path] + list(project_paths.values()) + [os.path.dirname(path) for path in project_paths.values()],
+                           outputs=list(build_output_paths.values()), skips=[f"{len(project_paths) - 1} more dotnet build calls"] if len(project_paths) > 1 else [], heavy=True,
+                           build_cache={"root": project_directory_path, "projects": [os.path.dirname(path) for path in project_paths.values()]})]
+    for project in layout_projects:
+        if project["template"] not in LIBRARY_TEMPLATES:
+            run_steps.append(make_step(f"run:{project['name']}", action=lambda log_prefix, log_file, output_callback, project_path=project_paths[project["name"]]: run_built_project(project_path, log_prefix, log_file, output_callback),
+                                       inputs=[build_output_paths[project["name"]]], skips=["restore", "build", "MSBuild evaluation"], timeout=RUN_STEP_TIMEOUT, heavy=True))
+            if startup_settings["enabled"]:
+                run_steps.append(make_step(f"startup:{project['name']}", action=lambda log_prefix, log_file, output_callback, project_path=project_paths[project["name"]]:
+                                           measure_startup_variants(project_path, project_directory_path, log_prefix, log_file, output_callback),
+                                           inputs=[build_output_paths[project["name"]]], timeout=(len(startup_settings["variants"]) + 1) * STARTUP_VARIANT_TIMEOUT, heavy=True))
+        elif test_settings["enabled"] and project["template"] in TEST_TEMPLATES:
+            # No outputs, so the tests run every time, like the smoke run; the shards share the step's build slot
+            run_steps.append(make_step(f"test:{project['name']}", action=lambda log_prefix, log_file, output_callback, project_path=project_paths[project["name"]]:
+                                       run_test_project(project_path, project_directory_path, log_prefix, log_file, output_callback),
+                                       inputs=[build_output_paths[project["name"]]], skips=["build"], heavy=True))
+    return scaffold_steps, run_steps
+
+def build_project_steps(project_name, project_directory_path, template="console", framework=None, scaffold="dotnet", log_prefix="", layout_projects=None, build=True, run=True,
+                        force=False):
+    solution_path = os.path.join(project_directory_path, f"{project_name}.sln")
+    project_path = os.path.join(project_directory_path, project_name, f"{project_name}.csproj")
+
+    if layout_projects is not None:
+        scaffold_steps, run_steps = build_layout_steps(project_name, project_directory_path, layout_projects, framework, scaffold, force)
+    elif scaffold == "native":
+        target_framework = get_native_target_framework(template, framework, os.path.dirname(project_directory_path))
+        if target_framework is not None:
+            scaffold_steps = [make_step("generate", action=lambda log_prefix, log_file, output_callback: asyncio.to_thread(generate_native_project, project_name, project_directory_path, template, target_framework, log_prefix, force),
+                                        outputs=[solution_path, project_path], skips=["dotnet new", "dotnet sln add", "restore"], keep_existing=not force)]
+        else:
+            print(f"{log_prefix}Native generation does not support this template or SDK; falling back to dotnet new")
+            scaffold_steps = build_scaffold_steps(project_name, project_directory_path, template, framework, force)
+    elif scaffold == "cache":
+        scaffold_steps = [make_step("clone-template", action=lambda log_prefix, log_file, output_callback: asyncio.to_thread(scaffold_from_template_cache, project_name, project_directory_path, template, framework, log_prefix, log_file, force),
+                                    outputs=[solution_path, project_path], skips=["dotnet new", "dotnet sln add", "restore"], keep_existing=not force)]
+    else:
+        scaffold_steps = build_scaffold_steps(project_name, project_directory_path, template, framework, force)
+    if layout_projects is None:
+        run_steps = build_run_steps(project_name, project_directory_path, template)
+    if not run:
+        # The build and the tests; the startup comparison launches the app too, so it goes with the run
+        run_steps = [step for step in run_steps if step["name"].partition(":")[0] not in ("run", "startup")]
+
+    nuget_config_path = os.path.join(project_directory_path, NUGET_CONFIG_FILE)
+    if nuget_settings["offline"]:
+        # The solution directory's nuget.config limits the restore in the build step to the local feed
+        scaffold_steps.append(make_step("nuget-config", action=lambda log_prefix, log_file, output_callback: asyncio.to_thread(write_nuget_config, nuget_config_path),
+                                        outputs=[nuget_config_path], skips=["online restore"]))
+        run_steps[0]["inputs"].append(nuget_config_path)
+    else:
+        remove_generated_nuget_config(nuget_config_path)
+    return scaffold_steps + run_steps if build else scaffold_steps
+
+def get_step_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def resolve_step_dependencies(steps):
+    # Each input depends on the latest earlier step that writes it, so in-place updates (like sln add) keep their order
+    latest_producers = {}
+    dependencies = {}
+    for step in steps:
+        if step["name"] in dependencies:
+            raise ValueError(f"Duplicate step name '{step['name']}'.")
+        for required_step in step["requires"]:
+            if required_step not in dependencies:
+                raise ValueError(f"Step '{step['name']}' requires '{required_step}', which is not declared before it.")
+
+        prerequisites = set(step["requires"])
+        prerequisites.update(latest_producers[get_step_key(path)] for path in step["inputs"] if get_step_key(path) in latest_producers)
+        dependencies[step["name"]] = prerequisites
+        for path in step["outputs"]:
+            latest_producers[get_step_key(path)] = step["name"]
+    return dependencies
+
+async def run_single_step(step, log_prefix="", log_file=None, output_callback=None, event_callback=None, step_timeout=None, metrics_log=None, journal=None):
+    if event_callback is not None:
+        event_callback({"type": "step-start", "step": step["name"]})
+    step_metrics = {"name": step["name"], "start": time.time(), "duration": 0.0, "cpu_time": 0.0, "peak_rss": 0, "status": "failed"}
+    # Hashing the inputs reads whole files and trees, so it runs off the event loop like the build cache key
+    if journal is not None and await asyncio.to_thread(is_step_current, journal, step):
+        print(f"{log_prefix}Skipping step '{step['name']}': already done and its inputs have not changed")
+        step_metrics["status"] = "up to date"
+    elif step["keep_existing"] and step["outputs"] and all(os.path.exists(path) for path in step["outputs"]):
+        # No journal (a project made elsewhere, or one dropped after an SDK change) must not mean scaffolding over the user's files
+        print(f"{log_prefix}Skipping step '{step['name']}': its files already exist (--force scaffolds them again)")
+        step_metrics["status"] = "up to date"
+        if journal is not None:
+            record_step(journal, step, await asyncio.to_thread(get_input_fingerprints, journal, step), True)
+    if step_metrics["status"] == "up to date":
+        if metrics_log is not None:
+            metrics_log.append(step_metrics)
+        if event_callback is not None:
+            event_callback(get_step_event(step, step_metrics))
+        return step_metrics
+
+    input_fingerprints = await asyncio.to_thread(get_input_fingerprints, journal, step) if journal is not None else None
+    step_error = None
+    build_cache_key = await asyncio.to_thread(get_build_cache_key, step) if step["build_cache"] is not None and build_cache_settings["enabled"] else None
+    scheduler = None
+    start_time = time.perf_counter()
+    # --step-timeout overrides every step's budget, and 0 turns the watchdog off
+    timeout = (step_timeout if step_timeout is not None else step["timeout"] or STEP_TIMEOUT) or None
+    try:
+        # Restoring cached output only copies files, so a hit does not wait for a build slot
+        if build_cache_key is not None and await asyncio.to_thread(restore_build_outputs, step, build_cache_key, log_prefix):
+            step_metrics["build_cache"] = "hit"
+        else:
+            step_scheduler = heavy_step_scheduler.get() if step["heavy"] else None
+            if step_scheduler is not None:
+                step_metrics["queued"] = await acquire_heavy_slot(step_scheduler, step["name"], log_prefix)
+                scheduler = step_scheduler  # Only a slot that was acquired is released
+            current_step_metrics.set(step_metrics)  # Each step runs in its own task, so this does not leak into other steps
+            start_time = time.perf_counter()
+            if step["command"] is not None:
+                # MSBuild's parallelism and logging are not part of the step's definition, so the journal ignores them
+                step_work = execute_single_command(step["command"] + get_msbuild_arguments(step["command"], scheduler) + get_binary_log_arguments(step, step_metrics, journal),
+                                                   log_prefix, output_callback, log_file)
+            else:
+                step_work = step["action"](log_prefix, log_file, output_callback)
+            try:
+                await asyncio.wait_for(step_work, timeout)
+            except asyncio.TimeoutError:
+                print(f"{log_prefix}Step '{step['name']}' timed out after {timeout} seconds.")
+                raise CommandFailedError(f"Stopping execution because step '{step['name']}' timed out.")
+            if build_cache_key is not None:
+                step_metrics["build_cache"] = "miss"
+                await asyncio.to_thread(store_build_outputs, step, build_cache_key, log_prefix)
+        step_metrics["status"] = "succeeded"
+    except Exception as e:
+        if "binary_log" in step_metrics:
+            print(f"{log_prefix}Full build log: {step_metrics['binary_log']}")
+        step_error = e
+        raise
+    finally:
+        step_metrics["duration"] = time.perf_counter() - start_time
+        if scheduler is not None:
+            release_heavy_slot(scheduler)
+        if metrics_log is not None:
+            metrics_log.append(step_metrics)
+        if journal is not None:
+            record_step(journal, step, input_fingerprints, step_metrics["status"] == "succeeded")
+        if event_callback is not None and (step_metrics["status"] == "succeeded" or step_error is not None):  # A cancelled step has no outcome to report
+            event_callback(get_step_event(step, step_metrics, step_error))
+    return step_metrics
+
+def get_step_event(step, step_metrics, error=None):
+    event = {"type": "step-failed" if error is not None else "step-finish", "step": step["name"], "status": step_metrics["status"],
+             "duration": round(step_metrics["duration"], 3), "outputs": step["outputs"]}
+    for key in ("exit_code", "build_cache", "binary_log", "tests", "startup"):
+        if key in step_metrics:
+            event[key] = step_metrics[key]
+    if error is not None:
+        event["error"] = str(error)
+    return event
+
+async def run_step_graph(steps, log_prefix="", log_file=None, output_callback=None, max_concurrency=None, event_callback=None, step_timeout=None,
+                         metrics_log=None, journal=None):
+    dependencies = resolve_step_dependencies(steps)
+    pending_steps = {step["name"]: step for step in steps}
+    completed_steps = set()
+    step_metrics = {}
+    running_steps = {}
+    failure = None
+    max_concurrency = max_concurrency or len(steps) or 1
+
+    try:
+        while pending_steps or running_steps:
+            if failure is None:  # After a failure, let running steps finish but start nothing new
+                for step_name, step in list(pending_steps.items()):
+                    if dependencies[step_name] <= completed_steps and len(running_steps) < max_concurrency:
+                        del pending_steps[step_name]
+                        step_task = asyncio.create_task(run_single_step(step, log_prefix, log_file, output_callback, event_callback, step_timeout, metrics_log, journal))
+                        running_steps[step_task] = step_name
+            if not running_steps:
+                break
+
+            finished_steps, _ = await asyncio.wait(running_steps, return_when=asyncio.FIRST_COMPLETED)
+            for step_task in finished_steps:
+                step_name = running_steps.pop(step_task)
+                try:
+                    step_metrics[step_name] = step_task.result()
+                    completed_steps.add(step_name)
+                except Exception as e:  # run_single_step has already reported it
+                    failure = failure or e
+    finally:
+        # Cancellation (Ctrl-C, a cancelled batch) stops every running step, which kills its command
+        for step_task in running_steps:
+            step_task.cancel()
+        if running_steps:
+            await asyncio.gather(*running_steps, return_exceptions=True)
+
+    if failure is not None:
+        raise failure
+    return {step["name"]: step_metrics[step["name"]] for step in steps}  # In declaration order
+
+def format_memory(byte_count):
+    return f"{byte_count / (1024 * 1024):.0f} MiB" if byte_count else "-"
+
+def print_phase_summary(steps, step_metrics, project_metrics, log_prefix=""):
+    name_width = max([16] + [len(step["name"]) + 2 for step in steps])  # Layout step names include the project name
+    print(f"{log_prefix}{'Phase summary:':<{name_width + 2}}{'wall':>9}{'cpu':>9}{'peak rss':>11}")
+    for step in steps:
+        metrics = step_metrics[step["name"]]
+        if metrics["status"] == "up to date":
+            skipped = "  (up to date, not run)"
+        elif metrics.get("build_cache") == "hit":
+            skipped = "  (restored from build cache)"
+        else:
+            skipped = f"  (skipped: {', '.join(step['skips'])})" if step["skips"] else ""
+        print(f"{log_prefix}  {step['name']:<{name_width}}{metrics['duration']:>8.2f}s{metrics['cpu_time']:>8.2f}s{format_memory(metrics['peak_rss']):>11}{skipped}")
+    print(f"{log_prefix}  {'total':<{name_width}}{project_metrics['duration']:>8.2f}s{project_metrics['cpu_time']:>8.2f}s{format_memory(project_metrics['peak_rss']):>11}")
+
+def open_command_log(project_name, log_directory):
+    if not log_directory:
+        return None
+    os.makedirs(log_directory, exist_ok=True)
+    return open(os.path.join(log_directory, f"{project_name}.log"), "w", encoding="utf-8")
+
+async def run_project_pipeline(project_name, base_directory=None, template="console", framework=None, log_prefix="", log_directory=None, scaffold="dotnet",
+                               step_timeout=None, output_callback=None, event_callback=None, project_metrics=None, force=False, layout=None, build=True, run=True):
+    current_directory = base_directory or os.getcwd()
+    project_directory_path = os.path.join(current_directory, project_name)
+    if event_callback is not None:
+        project_event_callback = event_callback
+        event_callback = lambda event: project_event_callback(dict(event, project=project_name))  # Batch events interleave, so each names its project
+
+    layout_projects = get_layout_projects(project_name, layout, template)
+    if test_settings["enabled"]:
+        layout_projects = add_test_project(project_name, layout_projects, template)
+    dotnet_environment = await asyncio.to_thread(get_dotnet_environment, current_directory)
+    for project_template in sorted({layout_project["template"] for layout_project in layout_projects or [{"template": template}]}):
+        check_preflight(dotnet_environment, project_template, framework)
+    if heavy_step_scheduler.get() is None:  # A batch has already set up one scheduler for all of its projects
+        heavy_step_scheduler.set(make_resource_scheduler(1))
+    os.makedirs(project_directory_path, exist_ok=True)
+
+    if project_metrics is None:
+        project_metrics = {}
+    project_metrics.update(name=project_name, directory=project_directory_path, start=time.time(), steps=[])
+    log_file = open_command_log(project_name, log_directory)
+    try:
+        start_time = time.perf_counter()
+        steps = await asyncio.to_thread(build_project_steps, project_name, project_directory_path, template, framework, scaffold, log_prefix, layout_projects, build, run, force)
+        journal_context = {"sdk": dotnet_environment["sdk_version"], "template": template, "framework": framework, "scaffold": scaffold, "layout": layout_projects}
+        journal = load_step_journal(project_directory_path, journal_context, force)
+        if event_callback is not None:
+            event_callback({"type": "plan", "steps": [step["name"] for step in steps]})
+        step_metrics = await run_step_graph(steps, log_prefix, log_file, output_callback, event_callback=event_callback, step_timeout=step_timeout,
+                                            metrics_log=project_metrics["steps"], journal=journal)
+        if nuget_settings["enabled"]:
+            await asyncio.to_thread(record_package_usage, project_directory_path, log_prefix)
+        roll_up_project_metrics(project_metrics, time.perf_counter() - start_time)
+        print_phase_summary(steps, step_metrics, project_metrics, log_prefix)
+    finally:
+        if "duration" not in project_metrics:  # Failed or cancelled: still report the steps that ran
+            roll_up_project_metrics(project_metrics, time.perf_counter() - start_time)
+        if log_file is not None:
+            log_file.close()
+        if event_callback is not None:
+            event_callback({"type": "project-finish", "status": project_metrics["status"], "duration": round(project_metrics["duration"], 3),
+                            "directory": project_directory_path})
+    return project_directory_path
+
+def console_execute_dotnet_commands(project_name, base_directory=None, template="console", framework=None, log_prefix="", log_directory=None, scaffold="dotnet",
+                                    step_timeout=None, project_metrics=None, force=False, layout=None, event_callback=None, build=True, run=True, watch=False):
+    failed_steps = []
+    def record_event(event):
+        if event["type"] == "step-failed":
+            failed_steps.append(event["step"])
+        if event_callback is not None:
+            event_callback(event)
+
+    try:
+        asyncio.run(run_project_pipeline(project_name, base_directory, template, framework, log_prefix, log_directory, scaffold, step_timeout,
+                                         event_callback=record_event, project_metrics=project_metrics, force=force, layout=layout, build=build, run=run))
+    except CommandFailedError as e:
+        # Preflight, probe, scaffolding and nuget.config errors are not in the project's files, so no edit can fix them
+        if not watch or not failed_steps or any(step_name.partition(":")[0] not in WATCH_RECOVERABLE_STEPS for step_name in failed_steps):
+            raise SystemExit(str(e))
+        print(f"{log_prefix}{e}")  # Keep watching: fixing the error is the change that triggers the next build
+    except KeyboardInterrupt:
+        raise SystemExit("Cancelled. Every command CARPS started was stopped.")
+    if watch:
+        try:
+            asyncio.run(watch_project(project_name, base_directory, template, framework, log_prefix, log_directory, scaffold, step_timeout, event_callback, layout, run))
+        except KeyboardInterrupt:
+            print(f"{log_prefix}Stopped watching. Every command CARPS started was stopped.")
+
+async def run_until_cancelled(coroutine, cancel_request):
+    # Another thread (the window's Cancel button) sets cancel_request; cancelling the task stops every running command and its children
+    task = asyncio.create_task(coroutine)
+    while not task.done():
+        await asyncio.wait({task}, timeout=CANCEL_POLL_INTERVAL)
+        if cancel_request.is_set():
+            task.cancel()
+            break
+    return await task
+
+def execute_dotnet_commands(project_name, gui_events, cancel_request=None):
+    # Runs on a worker thread: it only publishes events, and the Tk mainloop applies them in process_gui_events
+    cancel_request = cancel_request or threading.Event()
+    try:
+        project_directory_path = asyncio.run(run_until_cancelled(run_project_pipeline(project_name, output_callback=lambda line: gui_events.put({"type": "output", "line": line}),
+                                                                                      event_callback=gui_events.put), cancel_request))
+    except asyncio.CancelledError:
+        gui_events.put({"type": "cancelled"})
+    except Exception as e:
+        gui_events.put({"type": "failed", "error": str(e)})
+    else:
+        gui_events.put({"type": "finished", "directory": project_directory_path})
+
+################################################################
+# Environment probe
+
+def get_command_environment():
+    # Settings the caller exported explicitly win over CARPS's defaults
+    return {**DOTNET_ENVIRONMENT_DEFAULTS, **os.environ, **command_environment}
+
+def find_global_json(working_directory):
+    directory_path = os.path.abspath(working_directory)
+    while True:
+        global_json_path = os.path.join(directory_path, "global.json")
+        if os.path.isfile(global_json_path):
+            return global_json_path
+        parent_directory_path = os.path.dirname(directory_path)
+        if parent_directory_path == directory_path:
+            return None
+        directory_path = parent_directory_path
+
+def get_modification_time(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def get_probe_cache_key(dotnet_path, working_directory):
+    # The dotnet binary, its installed SDKs, an SDK pinned by global.json and installed template packages decide what the probe finds
+    dotnet_root = os.path.dirname(dotnet_path)
+    watched_paths = [dotnet_path, os.path.join(dotnet_root, "sdk"), find_global_json(working_directory),
+                     os.path.join(os.path.expanduser("~"), ".templateengine", "packages")]
+    fingerprint = [f"{path}|{get_modification_time(path)}" for path in watched_paths if path]
+    return hashlib.sha256(json.dumps([PROBE_CACHE_VERSION] + fingerprint).encode("utf-8")).hexdigest()[:16]
+
+def parse_template_list(template_list):
+    # dotnet new list prints a table; the dashes under the header give the column positions, and short names are the second column
+    lines = template_list.splitlines()
+    for index, line in enumerate(lines):
+        columns = [match.span() for match in re.finditer(r"-+", line)]
+        if len(columns) >= 2 and line.strip().startswith("-") and set(line.strip()) <= {"-", " "}:
+            short_name_start, short_name_end = columns[1]
+            return sorted({short_name.strip() for row in lines[index + 1:] for short_name in row[short_name_start:short_name_end].split(",") if short_name.strip()})
+    return None  # Unknown format: templates are not checked
+
+def run_probe_command(dotnet_path, arguments, working_directory, environment):
+    try:
+        result = subprocess.run([dotnet_path] + arguments, cwd=working_directory, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                env=environment, encoding="utf-8", errors="replace", timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise CommandFailedError(f"dotnet {' '.join(arguments)} did not finish within {PROBE_TIMEOUT} seconds.")
+    if result.returncode != 0:
+        message = "\n".join(line.rstrip() for line in (result.stderr.strip() or result.stdout.strip()).splitlines() if line.strip())
+        raise CommandFailedError(f"dotnet {' '.join(arguments)} failed (exit code {result.returncode}):\n{message}")
+    return result.stdout
+
+def probe_dotnet_environment(dotnet_path, working_directory):
+    environment = {**get_command_environment(), "DOTNET_CLI_UI_LANGUAGE": "en"}  # Template tables are localized
+    cli_home = os.path.join(environment.get("DOTNET_CLI_HOME") or os.path.expanduser("~"), ".dotnet")
+    sentinels = set(os.listdir(cli_home)) if os.path.isdir(cli_home) else set()  # Listed before the probe's own commands create them
+
+    # Run from the target directory so a global.json there selects the same SDK the project will use
+    sdk_version = run_probe_command(dotnet_path, ["--version"], working_directory, environment).strip()
+    sdks = [line.split(" [")[0] for line in run_probe_command(dotnet_path, ["--list-sdks"], working_directory, environment).splitlines() if line.strip()]
+    list_arguments = ["new", "list"] if int(sdk_version.split(".")[0]) >= 7 else ["new", "--list"]
+    try:
+        templates = parse_template_list(run_probe_command(dotnet_path, list_arguments, working_directory, environment))
+    except CommandFailedError:
+        templates = None
+    return {"dotnet": dotnet_path, "sdk_version": sdk_version, "sdks": sdks, "templates": templates,
+            "first_run": f"{sdk_version}.dotnetFirstUseSentinel" not in sentinels, "probed": time.time()}
+
+def get_dotnet_environment(working_directory=None):
+    working_directory = working_directory or os.getcwd()
+    dotnet_path = shutil.which("dotnet")
+    if dotnet_path is None:
+        raise CommandFailedError("The dotnet command was not found. Install the .NET SDK and make sure dotnet is on PATH.")
+    dotnet_path = os.path.realpath(dotnet_path)
+    cache_key = get_probe_cache_key(dotnet_path, working_directory)
+
+    with dotnet_environment_lock:
+        if cache_key in dotnet_environment_cache:
+            return dotnet_environment_cache[cache_key]
+        probe_path = os.path.join(get_carps_cache_directory(), "probes", f"{cache_key}.json")
+        try:
+            with open(probe_path, encoding="utf-8") as probe_file:
+                dotnet_environment = json.load(probe_file)
+        except (OSError, ValueError):
+            dotnet_environment = probe_dotnet_environment(dotnet_path, working_directory)
+            os.makedirs(os.path.dirname(probe_path), exist_ok=True)
+            temporary_path = f"{probe_path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as probe_file:
+                json.dump(dotnet_environment, probe_file, indent=2)
+            os.replace(temporary_path, probe_path)
+        dotnet_environment_cache[cache_key] = dotnet_environment
+        return dotnet_environment
+
+def get_dotnet_sdk_version(working_directory=None):
+    return get_dotnet_environment(working_directory)["sdk_version"]
+
+def check_preflight(dotnet_environment, template="console", framework=None):
+    # Everything a project needs from the SDK is checked before any directory is created
+    if not dotnet_environment["sdks"]:
+        raise CommandFailedError("No .NET SDK is installed (dotnet only has runtimes). Install the .NET SDK.")
+    if dotnet_environment["templates"] is not None and template not in dotnet_environment["templates"]:
+        raise CommandFailedError(f"The dotnet template '{template}' is not installed for .NET SDK {dotnet_environment['sdk_version']} (see dotnet new list).")
+    framework_version = re.match(r"^net(\d+)\.\d+$", framework or "")
+    if framework_version and int(framework_version.group(1)) >= 5 and int(framework_version.group(1)) > int(dotnet_environment["sdk_version"].split(".")[0]):
+        raise CommandFailedError(f"Target framework {framework} needs a .NET SDK {framework_version.group(1)} or newer, but this directory uses "
+                                 f"SDK {dotnet_environment['sdk_version']}.")
+
+def print_dotnet_environment(dotnet_environment):
+    print(f"dotnet: {dotnet_environment['dotnet']}")
+    print(f".NET SDK in use: {dotnet_environment['sdk_version']}")
+    print(f"Installed SDKs: {', '.join(dotnet_environment['sdks']) or 'none'}")
+    templates = dotnet_environment["templates"]
+    print(f"Templates: {len(templates)} installed" if templates is not None else "Templates: unknown")
+    if dotnet_environment["first_run"]:
+        print("This SDK had not been used on this machine before; its first-use setup is skipped for CARPS's commands.")
+
+################################################################
+# Golden-template cache
+
+def get_carps_cache_directory():
+    if os.environ.get("CARPS_CACHE_DIR"):
+        return os.environ["CARPS_CACHE_DIR"]
+    if os.name == "nt":
+        return os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "CARPS", "cache")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "carps")
+
+def get_template_cache_key(sdk_version, template, framework):
+    options = json.dumps({"sdk": sdk_version, "template": template, "framework": framework}, sort_keys=True)
+    return hashlib.sha256(options.encode("utf-8")).hexdigest()[:16]
+
+def read_template_metadata(template_directory):
+    try:
+        with open(os.path.join(template_directory, TEMPLATE_METADATA_FILE), encoding="utf-8") as metadata_file:
+            return json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+
+def prune_template_cache(templates_directory, sdk_version):
+    # Golden copies made by another SDK would produce stale project files, so they are evicted
+    for entry in os.listdir(templates_directory):
+        entry_path = os.path.join(templates_directory, entry)
+        metadata = read_template_metadata(entry_path)
+        if os.path.isdir(entry_path) and (metadata is None or metadata.get("sdk") != sdk_version):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+def create_golden_template(templates_directory, cache_key, sdk_version, template, framework, log_prefix="", log_file=None):
+    staging_directory = tempfile.mkdtemp(prefix=f"{cache_key}-", dir=templates_directory)
+    try:
+        # Called from a worker thread (asyncio.to_thread), so the golden copy is scaffolded on that thread's own event loop
+        asyncio.run(run_step_graph(build_scaffold_steps(TEMPLATE_PLACEHOLDER_NAME, staging_directory, template, framework), log_prefix, log_file))
+
+        # Restore output holds absolute paths of the golden copy, so the first build restores instead
+        for root_directory, directory_names, _ in os.walk(staging_directory):
+            for directory_name in [name for name in directory_names if name in ("bin", "obj")]:
+                shutil.rmtree(os.path.join(root_directory, directory_name))
+                directory_names.remove(directory_name)
+
+        metadata = {"sdk": sdk_version, "template": template, "framework": framework, "created": time.time()}
+        with open(os.path.join(staging_directory, TEMPLATE_METADATA_FILE), "w", encoding="utf-8") as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+
+        template_directory = os.path.join(templates_directory, cache_key)
+        try:
+            os.rename(staging_directory, template_directory)
+        except OSError:
+            shutil.rmtree(staging_directory, ignore_errors=True)  # Another process published it first
+        return template_directory
+    except BaseException:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        raise
+
+def get_golden_template(template, framework, working_directory=None, log_prefix="", log_file=None):
+    sdk_version = get_dotnet_sdk_version(working_directory)
+    cache_key = get_template_cache_key(sdk_version, template, framework)
+    templates_directory = os.path.join(get_carps_cache_directory(), "templates")
+    template_directory = os.path.join(templates_directory, cache_key)
+
+    with template_cache_lock:
+        if read_template_metadata(template_directory) is not None:
+            print(f"{log_prefix}Using cached {template} template for .NET SDK {sdk_version}")
+            return template_directory
+
+        print(f"{log_prefix}Creating cached {template} template for .NET SDK {sdk_version}")
+        os.makedirs(templates_directory, exist_ok=True)
+        prune_template_cache(templates_directory, sdk_version)
+        return create_golden_template(templates_directory, cache_key, sdk_version, template, framework, log_prefix, log_file)
+
+def get_namespace_name(project_name):
+    # Mirrors how dotnet new turns a project name into its root namespace: each dotted part becomes a valid identifier
+    namespace_parts = [re.sub(r"[^A-Za-z0-9_]", "_", name_part) for name_part in project_name.split(".")]
+    return ".".join(f"_{namespace_part}" if namespace_part[:1].isdigit() else namespace_part for namespace_part in namespace_parts)
+
+def rewrite_solution_guids(solution_text):
+    # Project type GUIDs stay, but every project/solution instance gets its own GUID
+    type_guids = set(re.findall(r'Project\("\{([0-9A-Fa-f-]+)\}"\)', solution_text))
+    new_guids = {}
+
+    def replace_guid(match):
+        guid = match.group(1).upper()
+        if guid in type_guids:
+            return match.group(0)
+        if guid not in new_guids:
+            new_guids[guid] = str(uuid.uuid4()).upper()
+        return "{" + new_guids[guid] + "}"
+
+    return re.sub(r"\{([0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12})\}", replace_guid, solution_text)
+
+def rewrite_template_file(source_path, destination_path, project_name, overwrite=False):
+    with open(source_path, encoding="utf-8", newline="") as source_file:
+        text = source_file.read()
+
+    extension = os.path.splitext(source_path)[1].lower()
+    namespace_name = get_namespace_name(project_name)
+    if extension == ".cs":
+        text = text.replace(TEMPLATE_PLACEHOLDER_NAME, namespace_name)
+    else:
+        text = text.replace(TEMPLATE_PLACEHOLDER_NAME, project_name)
+    if extension == ".sln":
+        text = rewrite_solution_guids(text)
+    if extension == ".csproj" and namespace_name != project_name and "<RootNamespace>" not in text:
+        newline = "\r\n" if "\r\n" in text else "\n"
+        text = text.replace("</TargetFramework>", f"</TargetFramework>{newline}    <RootNamespace>{namespace_name}</RootNamespace>", 1)
+
+    try:
+        with open(destination_path, "w" if overwrite else "x", encoding="utf-8", newline="") as destination_file:
+            destination_file.write(text)
+    except FileExistsError:
+        raise_existing_file_error(destination_path)
+
+def clone_golden_template(template_directory, project_name, project_directory_path, overwrite=False):
+    for root_directory, _, file_names in os.walk(template_directory):
+        relative_directory = os.path.relpath(root_directory, template_directory)
+        destination_directory = os.path.normpath(os.path.join(project_directory_path, relative_directory.replace(TEMPLATE_PLACEHOLDER_NAME, project_name)))
+        os.makedirs(destination_directory, exist_ok=True)
+
+        for file_name in file_names:
+            if root_directory == template_directory and file_name == TEMPLATE_METADATA_FILE:
+                continue
+            source_path = os.path.join(root_directory, file_name)
+            destination_path = os.path.join(destination_directory, file_name.replace(TEMPLATE_PLACEHOLDER_NAME, project_name))
+            if os.path.splitext(file_name)[1].lower() in TEMPLATE_TEXT_EXTENSIONS:
+                rewrite_template_file(source_path, destination_path, project_name, overwrite)
+            elif not overwrite and os.path.exists(destination_path):
+                raise_existing_file_error(destination_path)
+            else:
+                # Copied rather than hardlinked: these are the user's files to edit, and an in-place save must not reach the cache
+                shutil.copy2(source_path, destination_path)
+
+def scaffold_layout_project_from_template_cache(project_name, project_source_directory, template="console", framework=None, reference_paths=(), log_prefix="", log_file=None,
+                                                overwrite=False):
+    # Only the project folder of the golden copy is used; the layout's solution is made separately
+    template_directory = get_golden_template(template, framework, os.path.dirname(os.path.dirname(project_source_directory)), log_prefix, log_file)
+    print(f"{log_prefix}Cloning cached {template} template into: {project_source_directory}")
+    clone_golden_template(os.path.join(template_directory, TEMPLATE_PLACEHOLDER_NAME), project_name, project_source_directory, overwrite)
+    if reference_paths:
+        add_project_references(os.path.join(project_source_directory, f"{project_name}.csproj"), reference_paths)
+
+def scaffold_from_template_cache(project_name, project_directory_path, template="console", framework=None, log_prefix="", log_file=None, overwrite=False):
+    template_directory = get_golden_template(template, framework, os.path.dirname(project_directory_path), log_prefix, log_file)
+    print(f"{log_prefix}Cloning cached template into: {project_directory_path}")
+    clone_golden_template(template_directory, project_name, project_directory_path, overwrite)
+
+################################################################
+# Native project generator
+
+def get_native_target_framework(template, framework=None, working_directory=None):
+    if template not in NATIVE_PROJECT_TEMPLATES:
+        return None
+    if framework:
+        return framework if re.match(r"^net([6-9]|\d{2,})\.\d+$", framework) else None
+
+    sdk_major_version = int(get_dotnet_sdk_version(working_directory).split(".")[0])
+    # The generated files use implicit usings and nullable references, which need .NET 6 or newer
+    return f"net{sdk_major_version}.0" if sdk_major_version >= 6 else None
+
+def raise_existing_file_error(file_path):
+    # Like dotnet new without --force: a project that is already there holds the user's edits
+    raise CommandFailedError(f"Refusing to overwrite {file_path}, which already exists. Pass --force to scaffold the project again.")
+
+def write_generated_file(file_path, lines, overwrite=False):
+    # Same encoding and line endings as the files dotnet new writes
+    try:
+        with open(file_path, "w" if overwrite else "x", encoding="utf-8-sig", newline="") as generated_file:
+            generated_file.write("\r\n".join(lines) + "\r\n")
+    except FileExistsError:
+        raise_existing_file_error(file_path)
+
+def generate_solution_file(solution_path, projects, overwrite=False):
+    lines = [
+        "",
+        "Microsoft Visual Studio Solution File, Format Version 12.00",
+        "# Visual Studio Version 17",
+        "VisualStudioVersion = 17.0.31903.59",
+        "MinimumVisualStudioVersion = 10.0.40219.1",
+    ]
+    project_guids = [str(uuid.uuid4()).upper() for _ in projects]
+    for (project_name, relative_project_path), project_guid in zip(projects, project_guids):
+        lines.append(f'Project("{{{CSHARP_PROJECT_TYPE_GUID}}}") = "{project_name}", "{relative_project_path}", "{{{project_guid}}}"')
+        lines.append("EndProject")
+
+    lines.append("Global")
+    lines.append("\tGlobalSection(SolutionConfigurationPlatforms) = preSolution")
+    for configuration in SOLUTION_CONFIGURATIONS:
+        lines.append(f"\t\t{configuration}|Any CPU = {configuration}|Any CPU")
+    lines.append("\tEndGlobalSection")
+    lines.append("\tGlobalSection(SolutionProperties) = preSolution")
+    lines.append("\t\tHideSolutionNode = FALSE")
+    lines.append("\tEndGlobalSection")
+    if projects:
+        lines.append("\tGlobalSection(ProjectConfigurationPlatforms) = postSolution")
+        for project_guid in project_guids:
+            for configuration in SOLUTION_CONFIGURATIONS:
+                lines.append(f"\t\t{{{project_guid}}}.{configuration}|Any CPU.ActiveCfg = {configuration}|Any CPU")
+                lines.append(f"\t\t{{{project_guid}}}.{configuration}|Any CPU.Build.0 = {configuration}|Any CPU")
+        lines.append("\tEndGlobalSection")
+    lines.append("EndGlobal")
+
+    write_generated_file(solution_path, lines, overwrite)
+    return project_guids
+
+def generate_project_file(project_path, project_name, template, target_framework, reference_paths=(), overwrite=False):
+    properties = []
+    if template == "console":
+        properties.append("<OutputType>Exe</OutputType>")
+    properties.append(f"<TargetFramework>{target_framework}</TargetFramework>")
+    namespace_name = get_namespace_name(project_name)
+    if namespace_name != project_name:
+        properties.append(f"<RootNamespace>{namespace_name}</RootNamespace>")
+    properties.append("<ImplicitUsings>enable</ImplicitUsings>")
+    properties.append("<Nullable>enable</Nullable>")
+
+    lines = ['<Project Sdk="Microsoft.NET.Sdk">', ""]
+    lines += get_project_reference_lines(project_path, reference_paths)
+    lines += ["  <PropertyGroup>"]
+    lines += [f"    {project_property}" for project_property in properties]
+    lines += ["  </PropertyGroup>", "", "</Project>"]
+    write_generated_file(project_path, lines, overwrite)
+
+def generate_source_files(project_source_directory, project_name, template, overwrite=False):
+    if template == "console":
+        write_generated_file(os.path.join(project_source_directory, "Program.cs"), [
+            "// See https://aka.ms/new-console-template for more information",
+            'Console.WriteLine("Hello, World!");',
+        ], overwrite)
+    elif template == "classlib":
+        write_generated_file(os.path.join(project_source_directory, "Class1.cs"), [
+            f"namespace {get_namespace_name(project_name)};",
+            "",
+            "public class Class1",
+            "{",
+            "",
+            "}",
+        ], overwrite)
+
+def get_project_reference_lines(project_path, reference_paths):
+    # Same place and form as dotnet add reference: an item group straight after the Project element, with Windows-style relative paths
+    if not reference_paths:
+        return []
+    project_directory = os.path.dirname(project_path)
+    relative_paths = [os.path.relpath(reference_path, project_directory).replace(os.sep, "\\") for reference_path in reference_paths]
+    return ["  <ItemGroup>"] + [f'    <ProjectReference Include="{relative_path}" />' for relative_path in relative_paths] + ["  </ItemGroup>", ""]
+
+def add_project_references(project_path, reference_paths):
+    with open(project_path, encoding="utf-8", newline="") as project_file:
+        text = project_file.read()
+    newline = "\r\n" if "\r\n" in text else "\n"
+    project_element_end = re.search(r"<Project\b[^>]*>", text).end()
+    reference_text = newline.join(get_project_reference_lines(project_path, reference_paths)) + newline
+    text = text[:project_element_end] + newline + newline + reference_text + text[project_element_end:].lstrip("\r\n")
+    with open(project_path, "w", encoding="utf-8", newline="") as project_file:
+        project_file.write(text)
+
+def generate_native_layout_project(project_name, project_source_directory, template, target_framework, reference_paths=(), log_prefix="", overwrite=False):
+    print(f"{log_prefix}Generating {template} project {project_name} for {target_framework}")
+    os.makedirs(project_source_directory, exist_ok=True)
+    generate_project_file(os.path.join(project_source_directory, f"{project_name}.csproj"), project_name, template, target_framework, reference_paths, overwrite)
+    generate_source_files(project_source_directory, project_name, template, overwrite)
+
+def generate_native_project(project_name, project_directory_path, template, target_framework, log_prefix="", overwrite=False):
+    print(f"{log_prefix}Generating {template} project files for {target_framework} in: {project_directory_path}")
+    project_source_directory = os.path.join(project_directory_path, project_name)
+    os.makedirs(project_source_directory, exist_ok=True)
+
+    generate_project_file(os.path.join(project_source_directory, f"{project_name}.csproj"), project_name, template, target_framework, overwrite=overwrite)
+    generate_source_files(project_source_directory, project_name, template, overwrite)
+    generate_solution_file(os.path.join(project_directory_path, f"{project_name}.sln"),
+                           [(project_name, f"{project_name}\\{project_name}.csproj")], overwrite)
+
+################################################################
+# Shared NuGet cache
+
+def get_nuget_cache_directory():
+    return os.path.join(get_carps_cache_directory(), "nuget")
+
+def configure_nuget_cache(offline=False):
+    # Every restore shares one packages folder; offline restores read only from the local feed next to it
+    nuget_directory = get_nuget_cache_directory()
+    nuget_settings.update(enabled=True, offline=offline, packages_directory=os.path.join(nuget_directory, "packages"),
+                          feed_directory=os.path.join(nuget_directory, "feed"))
+    os.makedirs(nuget_settings["packages_directory"], exist_ok=True)
+    os.makedirs(nuget_settings["feed_directory"], exist_ok=True)
+    command_environment["NUGET_PACKAGES"] = nuget_settings["packages_directory"]
+
+def write_nuget_config(nuget_config_path):
+    if os.path.exists(nuget_config_path):
+        with open(nuget_config_path, encoding="utf-8-sig") as nuget_config_file:
+            if NUGET_CONFIG_MARKER not in nuget_config_file.read():
+                raise CommandFailedError(f"Refusing to replace {nuget_config_path}, which was not generated by CARPS.")
+    feed_directory = html.escape(nuget_settings["feed_directory"], quote=True)  # The cache folder may contain &, < or quotes
+    write_generated_file(nuget_config_path, [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        "<configuration>",
+        f"  <!-- {NUGET_CONFIG_MARKER} -->",
+        "  <packageSources>",
+        "    <clear />",
+        f'    <add key="carps-offline" value="{feed_directory}" />',
+        "  </packageSources>",
+        "</configuration>",
+    ], overwrite=True)
+
+def remove_generated_nuget_config(nuget_config_path):
+    try:
+        with open(nuget_config_path, encoding="utf-8-sig") as nuget_config_file:
+            generated = NUGET_CONFIG_MARKER in nuget_config_file.read()
+    except OSError:
+        return
+    if generated:
+        os.remove(nuget_config_path)  # Left over from an offline run; online runs use the normal sources again
+
+def get_directory_size(directory_path):
+    total_size = 0
+    for root_directory, _, file_names in os.walk(directory_path):
+        for file_name in file_names:
+            try:
+                total_size += os.path.getsize(os.path.join(root_directory, file_name))
+            except OSError:
+                pass
+    return total_size
+
+def list_cached_packages(packages_directory):
+    # Both the packages folder and the feed use the <id>/<version>/ layout, with lowercase names
+    packages = []
+    for package_id in sorted(os.listdir(packages_directory)) if os.path.isdir(packages_directory) else []:
+        package_directory = os.path.join(packages_directory, package_id)
+        if not os.path.isdir(package_directory):
+            continue
+        for version in sorted(os.listdir(package_directory)):
+            if os.path.exists(os.path.join(package_directory, version, f"{package_id}.{version}.nupkg")):
+                packages.append(f"{package_id}/{version}")
+    return packages
+
+def read_package_usage():
+    try:
+        with open(os.path.join(get_nuget_cache_directory(), NUGET_USAGE_FILE), encoding="utf-8") as usage_file:
+            return json.load(usage_file)
+    except (OSError, ValueError):
+        return {}
+
+def write_package_usage(package_usage):
+    usage_path = os.path.join(get_nuget_cache_directory(), NUGET_USAGE_FILE)
+    temporary_path = f"{usage_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as usage_file:
+        json.dump(package_usage, usage_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, usage_path)
+
+def get_restored_packages(project_directory_path):
+    packages = set()
+    for root_directory, directory_names, file_names in os.walk(project_directory_path):
+        directory_names[:] = [name for name in directory_names if name not in ("bin", JOURNAL_DIRECTORY)]
+        if os.path.basename(root_directory) == "obj" and "project.assets.json" in file_names:
+            with open(os.path.join(root_directory, "project.assets.json"), encoding="utf-8-sig") as assets_file:
+                libraries = json.load(assets_file).get("libraries", {})
+            packages.update(name.lower() for name, library in libraries.items() if library.get("type") == "package")
+    return packages
+
+def normalize_package_version(version):
+    # NuGet stores 1.0 as 1.0.0 and drops build metadata and a zero fourth part
+    version = version.split("+")[0].lower()
+    release, _, prerelease = version.partition("-")
+    parts = release.split(".")
+    parts += ["0"] * (3 - len(parts))
+    if len(parts) == 4 and int(parts[3]) == 0:
+        parts = parts[:3]
+    return ".".join(str(int(part)) for part in parts) + (f"-{prerelease}" if prerelease else "")
+
+def add_package_to_feed(package_path, feed_directory):
+    with zipfile.ZipFile(package_path) as package_archive:
+        nuspec_name = next(name for name in package_archive.namelist() if "/" not in name and name.endswith(".nuspec"))
+        nuspec = package_archive.read(nuspec_name)
+    package_id = re.search(rb"<id>\s*([^<\s]+)\s*</id>", nuspec).group(1).decode().lower()
+    version = normalize_package_version(re.search(rb"<version>\s*([^<\s]+)\s*</version>", nuspec).group(1).decode())
+    destination_directory = os.path.join(feed_directory, package_id, version)
+    if os.path.exists(destination_directory):
+        return False
+
+    # Folder feeds use the <id>/<version>/ layout with the package, its SHA-512 and its nuspec, all lowercase
+    staging_directory = f"{destination_directory}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(staging_directory)
+    shutil.copyfile(package_path, os.path.join(staging_directory, f"{package_id}.{version}.nupkg"))
+    with open(package_path, "rb") as package_file:
+        package_hash = base64.b64encode(hashlib.sha512(package_file.read()).digest()).decode()
+    with open(os.path.join(staging_directory, f"{package_id}.{version}.nupkg.sha512"), "w", encoding="utf-8") as hash_file:
+        hash_file.write(package_hash)
+    with open(os.path.join(staging_directory, f"{package_id}.nuspec"), "wb") as nuspec_file:
+        nuspec_file.write(nuspec)
+    try:
+        os.replace(staging_directory, destination_directory)  # Readers never see a half-copied package
+    except OSError:
+        shutil.rmtree(staging_directory, ignore_errors=True)  # Another worker added it first
+        return False
+    return True
+
+def seed_nuget_feed(source_directory, packages=None, log_prefix=""):
+    # Accepts a NuGet packages folder, a folder feed or a flat folder of .nupkg files
+    if packages is None:
+        if not os.path.isdir(source_directory):
+            raise CommandFailedError(f"Package folder not found: {source_directory}")
+        package_paths = [os.path.join(root_directory, file_name) for root_directory, _, file_names in os.walk(source_directory)
+                         for file_name in file_names if file_name.endswith(".nupkg")]
+    else:
+        package_paths = [os.path.join(source_directory, package, f"{package.replace('/', '.')}.nupkg") for package in sorted(packages)]
+    added_count = 0
+    for package_path in package_paths:
+        if os.path.exists(package_path) and add_package_to_feed(package_path, nuget_settings["feed_directory"]):
+            added_count += 1
+    if added_count:
+        print(f"{log_prefix}Added {added_count} packages to the offline feed")
+    return added_count
+
+def record_package_usage(project_directory_path, log_prefix=""):
+    packages = get_restored_packages(project_directory_path)
+    if not packages:
+        return
+    with nuget_usage_lock:
+        package_usage = read_package_usage()
+        package_usage.update({package: time.time() for package in packages})
+        write_package_usage(package_usage)
+    if not nuget_settings["offline"]:
+        seed_nuget_feed(nuget_settings["packages_directory"], packages, log_prefix)  # Keep the feed complete for later offline runs
+
+def prune_nuget_cache(size_limit):
+    # Removes the least recently restored package versions from the shared packages folder; the offline feed is kept whole
+    packages_directory = nuget_settings["packages_directory"]
+    with nuget_usage_lock:
+        package_usage = read_package_usage()
+        package_sizes = {package: get_directory_size(os.path.join(packages_directory, package)) for package in list_cached_packages(packages_directory)}
+        total_size = sum(package_sizes.values())
+        removed_count = 0
+        for package in sorted(package_sizes, key=lambda package: package_usage.get(package, 0)):
+            if total_size <= size_limit:
+                break
+            shutil.rmtree(os.path.join(packages_directory, package), ignore_errors=True)
+            total_size -= package_sizes[package]
+            package_usage.pop(package, None)
+            removed_count += 1
+        write_package_usage(package_usage)
+    return removed_count, total_size
+
+def print_nuget_cache_summary():
+    packages_directory, feed_directory = nuget_settings["packages_directory"], nuget_settings["feed_directory"]
+    print(f"NuGet packages folder: {len(list_cached_packages(packages_directory))} packages, {format_memory(get_directory_size(packages_directory))} ({packages_directory})")
+    print(f"Offline feed: {len(list_cached_packages(feed_directory))} packages, {format_memory(get_directory_size(feed_directory))} ({feed_directory})")
+
+################################################################
+# Build output cache
+
+def get_build_cache_directory():
+    return os.path.join(get_carps_cache_directory(), "builds")
+
+def configure_build_cache(size_limit=None):
+    build_cache_settings.update(enabled=True, size_limit=BUILD_CACHE_SIZE_LIMIT if size_limit is None else size_limit)
+    os.makedirs(get_build_cache_directory(), exist_ok=True)
+
+def get_build_cache_key(step):
+    # Keyed by what the compiler sees: the source and project files by their path in the solution folder, the SDK, the build command
+    # (and so the configuration) and the packages folder restore points at. The folder's own location is left out, so a project
+    # scaffolded again elsewhere hits; .sln files are left out because dotnet new gives every solution fresh GUIDs, and so are the
+    # folders builds, test runs, git and editors write to, which the compiler never reads.
+    root_directory = step["build_cache"]["root"]
+    build_command = [os.path.relpath(argument, root_directory) if os.path.isabs(argument) else argument for argument in step["command"]]
+    key_hash = hashlib.sha256(json.dumps({"version": BUILD_CACHE_VERSION, "sdk": get_dotnet_sdk_version(os.path.dirname(root_directory)), "command": build_command,
+                                          "packages": get_command_environment().get("NUGET_PACKAGES")}).encode("utf-8"))
+    for current_directory, directory_names, file_names in os.walk(root_directory):
+        directory_names[:] = sorted(name for name in directory_names if name not in WATCH_IGNORED_DIRECTORIES)
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(".sln"):
+                continue
+            file_path = os.path.join(current_directory, file_name)
+            key_hash.update(f"{os.path.relpath(file_path, root_directory).replace(os.sep, '/')}|{fingerprint_path(file_path)}\n".encode("utf-8"))
+    return key_hash.hexdigest()[:32]
+
+def get_build_root_replacements(root_directory):
+    # Restore output names the solution folder as plain text, and JSON-escaped in project.assets.json (which differs on Windows)
+    root_path = os.path.join(root_directory, "")
+    return [(json.dumps(root_path)[1:-1], BUILD_CACHE_ROOT_TOKENS[0]), (root_path, BUILD_CACHE_ROOT_TOKENS[1])]
+
+def copy_build_output(source_path, destination_path, replacements):
+    # Text outputs are rewritten for the new folder; binaries are copied as they are, since their embedded paths only point debuggers at the sources
+    if os.path.getsize(source_path) <= BUILD_CACHE_TEXT_LIMIT:
+        with open(source_path, "rb") as source_file:
+            content = source_file.read()
+        try:
+            text = content.decode("utf-8") if b"\0" not in content else None
+        except UnicodeDecodeError:
+            text = None
+        if text is not None:
+            rewritten_text = text
+            for old_text, new_text in replacements:
+                rewritten_text = rewritten_text.replace(old_text, new_text)
+            if rewritten_text != text:
+                with open(destination_path, "w", encoding="utf-8", newline="") as destination_file:
+                    destination_file.write(rewritten_text)
+                return
+    # Restored files get the current time, so MSBuild sees them as newer than the sources they were built from
+    shutil.copyfile(source_path, destination_path)
+
+def copy_build_outputs(source_directory, destination_directory, replacements):
+    for current_directory, _, file_names in os.walk(source_directory):
+        current_destination = os.path.normpath(os.path.join(destination_directory, os.path.relpath(current_directory, source_directory)))
+        os.makedirs(current_destination, exist_ok=True)
+        for file_name in file_names:
+            copy_build_output(os.path.join(current_directory, file_name), os.path.join(current_destination, file_name), replacements)
+
+def get_build_output_paths(step):
+    for project_directory in step["build_cache"]["projects"]:
+        for output_name in ("bin", "obj"):
+            output_path = os.path.join(project_directory, output_name)
+            yield output_path, os.path.relpath(output_path, step["build_cache"]["root"])
+
+def read_build_cache_entry(entry_directory):
+    try:
+        with open(os.path.join(entry_directory, BUILD_CACHE_ENTRY_FILE), encoding="utf-8") as entry_file:
+            return json.load(entry_file)
+    except (OSError, ValueError):
+        return None
+
+def write_build_cache_entry(entry_directory, entry):
+    entry_path = os.path.join(entry_directory, BUILD_CACHE_ENTRY_FILE)
+    temporary_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as entry_file:
+        json.dump(entry, entry_file, indent=2)
+    os.replace(temporary_path, entry_path)
+
+def list_build_cache_entries():
+    builds_directory = get_build_cache_directory()
+    entries = {}
+    for cache_key in os.listdir(builds_directory) if os.path.isdir(builds_directory) else []:
+        entry = read_build_cache_entry(os.path.join(builds_directory, cache_key)) if re.fullmatch(r"[0-9a-f]{32}", cache_key) else None
+        if entry is not None:  # Skips entries still being stored or being evicted
+            entries[cache_key] = entry
+    return entries
+
+def count_build_cache_result(result):
+    with build_cache_lock:
+        build_cache_statistics[result] += 1
+
+def restore_build_outputs(step, cache_key, log_prefix=""):
+    entry_directory = os.path.join(get_build_cache_directory(), cache_key)
+    entry = read_build_cache_entry(entry_directory)
+    if entry is None:
+        count_build_cache_result("misses")
+        return False
+
+    replacements = [(token, root_text) for root_text, token in get_build_root_replacements(step["build_cache"]["root"])]
+    try:
+        for output_path, relative_path in get_build_output_paths(step):
+            shutil.rmtree(output_path, ignore_errors=True)  # Output of an earlier build must not mix with the cached one
+            if os.path.isdir(os.path.join(entry_directory, relative_path)):
+                copy_build_outputs(os.path.join(entry_directory, relative_path), output_path, replacements)
+        entry["last_used"] = time.time()
+        write_build_cache_entry(entry_directory, entry)
+    except OSError as e:
+        # Evicted while it was being copied (eviction renames the entry first, so this never goes unnoticed): build instead
+        print(f"{log_prefix}Could not restore the cached build ({e}); building instead")
+        count_build_cache_result("misses")
+        return False
+    print(f"{log_prefix}Restored build output from the build cache ({cache_key[:12]})")
+    count_build_cache_result("hits")
+    return True
+
+def store_build_outputs(step, cache_key, log_prefix=""):
+    builds_directory = get_build_cache_directory()
+    entry_directory = os.path.join(builds_directory, cache_key)
+    if read_build_cache_entry(entry_directory) is not None:
+        return
+    replacements = get_build_root_replacements(step["build_cache"]["root"])
+    staging_directory = tempfile.mkdtemp(prefix=f"{cache_key}-", dir=builds_directory)
+    try:
+        for output_path, relative_path in get_build_output_paths(step):
+            if os.path.isdir(output_path):
+                copy_build_outputs(output_path, os.path.join(staging_directory, relative_path), replacements)
+        write_build_cache_entry(staging_directory, {"version": BUILD_CACHE_VERSION, "created": time.time(), "last_used": time.time(),
+                                                    "size": get_directory_size(staging_directory)})
+        os.rename(staging_directory, entry_directory)  # Readers never see a half-stored build
+    except OSError as e:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        if read_build_cache_entry(entry_directory) is None:  # Otherwise another worker stored the same build first
+            print(f"{log_prefix}Could not store the build output in the build cache: {e}")
+        return
+    count_build_cache_result("stored")
+    prune_build_cache(build_cache_settings["size_limit"])
+
+def prune_build_cache(size_limit):
+    # Evicts the least recently used builds until the cache fits
+    builds_directory = get_build_cache_directory()
+    with build_cache_lock:
+        entries = list_build_cache_entries()
+        total_size = sum(entry["size"] for entry in entries.values())
+        removed_count = 0
+        for cache_key in sorted(entries, key=lambda cache_key: entries[cache_key]["last_used"]):
+            if total_size <= size_limit:
+                break
+            entry_directory = os.path.join(builds_directory, cache_key)
+            evicted_directory = f"{entry_directory}.{uuid.uuid4().hex}.evicted"
+            try:
+                os.rename(entry_directory, evicted_directory)  # A restore in progress fails and builds instead of copying half an entry
+            except OSError:
+                continue
+            shutil.rmtree(evicted_directory, ignore_errors=True)
+            total_size -= entries[cache_key]["size"]
+            removed_count += 1
+        build_cache_statistics["evicted"] += removed_count
+    return removed_count, total_size
+
+def print_build_cache_summary():
+    entries = list_build_cache_entries()
+    print(f"Build cache: {build_cache_statistics['hits']} hits, {build_cache_statistics['misses']} misses, {build_cache_statistics['stored']} stored, "
+          f"{build_cache_statistics['evicted']} evicted; "
+          f"{len(entries)} builds, {format_memory(sum(entry['size'] for entry in entries.values()))} ({get_build_cache_directory()})")
+
+################################################################
+# Step journal
+
+def fingerprint_path(path):
+    # Files are hashed; directories use names, sizes and modification times, which is enough to notice an edit, a rebuild or a cleanup
+    if os.path.isfile(path):
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as fingerprinted_file:
+            for chunk in iter(lambda: fingerprinted_file.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+    if os.path.isdir(path):
+        directory_hash = hashlib.sha256()
+        for root_directory, directory_names, file_names in os.walk(path):
+            # Build output inside a source directory is fingerprinted by the build step's outputs, not as a source change
+            directory_names[:] = sorted(name for name in directory_names if root_directory != path or name not in JOURNAL_IGNORED_DIRECTORIES)
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root_directory, file_name)
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    continue
+                directory_hash.update(f"{os.path.relpath(file_path, path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}\n".encode("utf-8"))
+        return directory_hash.hexdigest()
+    return None
+
+def get_step_definition(step):
+    return hashlib.sha256(json.dumps({"name": step["name"], "command": step["command"]}).encode("utf-8")).hexdigest()
+
+def get_journal_path(journal, path):
+    return os.path.relpath(path, journal["project_directory"]).replace(os.sep, "/")
+
+def load_step_journal(project_directory_path, context, force=False):
+    journal_path = os.path.join(project_directory_path, JOURNAL_DIRECTORY, JOURNAL_FILE)
+    journal = {"version": JOURNAL_VERSION, "context": context, "steps": {}}
+    if not force:
+        try:
+            with open(journal_path, encoding="utf-8") as journal_file:
+                saved_journal = json.load(journal_file)
+            # A different SDK or different template options make every recorded step stale
+            if saved_journal.get("version") == JOURNAL_VERSION and saved_journal.get("context") == context:
+                journal["steps"] = saved_journal.get("steps", {})
+        except (OSError, ValueError):
+            pass
+    journal["path"] = journal_path
+    journal["project_directory"] = project_directory_path
+    return journal
+
+def save_step_journal(journal):
+    os.makedirs(os.path.dirname(journal["path"]), exist_ok=True)
+    temporary_path = f"{journal['path']}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as journal_file:
+        json.dump({key: journal[key] for key in ("version", "context", "steps")}, journal_file, indent=2)
+    os.replace(temporary_path, journal["path"])  # An interrupted run never leaves a half-written journal
+
+def get_input_fingerprints(journal, step):
+    # Files a step rewrites in place (like sln add) are its outputs, not inputs to compare
+    output_keys = {get_step_key(path) for path in step["outputs"]}
+    return {get_journal_path(journal, path): fingerprint_path(path) for path in step["inputs"] if get_step_key(path) not in output_keys}
+
+def is_step_current(journal, step):
+    entry = journal["steps"].get(step["name"])
+    if entry is None or not step["outputs"]:  # Steps with no outputs, like the smoke run, always run
+        return False
+    if entry["definition"] != get_step_definition(step):
+        return False
+    if get_input_fingerprints(journal, step) != entry["inputs"]:
+        return False
+    return all(os.path.exists(path) for path in step["outputs"])
+
+def record_step(journal, step, input_fingerprints, succeeded):
+    if succeeded:
+        journal["steps"][step["name"]] = {"definition": get_step_definition(step), "inputs": input_fingerprints, "finished": time.time()}
+    else:
+        journal["steps"].pop(step["name"], None)  # Resume from here next time
+    save_step_journal(journal)
+
+################################################################
+# Instrumentation
+
+def read_children_rusage():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def read_process_tree_usage(root_pid):
+    # Returns {pid: (rss_bytes, cpu_seconds)} for a process and all of its descendants
+    if psutil is not None:
+        try:
+            root_process = psutil.Process(root_pid)
+            tree = [root_process] + root_process.children(recursive=True)
+        except psutil.Error:
+            return {}
+        usage = {}
+        for tree_process in tree:
+            try:
+                with tree_process.oneshot():
+                    cpu_times = tree_process.cpu_times()
+                    usage[tree_process.pid] = (tree_process.memory_info().rss, cpu_times.user + cpu_times.system)
+            except psutil.Error:
+                pass
+        return usage
+
+    if not os.path.isdir("/proc"):
+        return {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    parents = {}
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8", errors="replace") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue  # The process exited while the table was being read
+        pid = int(entry)
+        parents[pid] = int(fields[1])
+        stats[pid] = (int(fields[21]) * page_size, (int(fields[11]) + int(fields[12])) / clock_ticks)
+
+    children = {}
+    for pid, parent_pid in parents.items():
+        children.setdefault(parent_pid, []).append(pid)
+    usage = {}
+    pending_pids = [root_pid]
+    while pending_pids:
+        pid = pending_pids.pop()
+        if pid in stats:
+            usage[pid] = stats[pid]
+            pending_pids.extend(children.get(pid, []))
+    return usage
+
+async def sample_command_usage(process, sampled_usage):
+    while process.returncode is None:
+        usage = read_process_tree_usage(process.pid)
+        if usage:
+            sampled_usage["peak_rss"] = max(sampled_usage["peak_rss"], sum(rss for rss, _ in usage.values()))
+            for pid, (_, cpu_time) in usage.items():
+                sampled_usage["processes"][pid] = max(cpu_time, sampled_usage["processes"].get(pid, 0.0))
+        await asyncio.sleep(USAGE_SAMPLE_INTERVAL)
+
+def begin_command_usage():
+    global running_command_count
+    with command_usage_lock:
+        running_command_count += 1
+        return {"rusage": read_children_rusage(), "exclusive": running_command_count == 1}
+
+def end_command_usage(usage_before, sampled_usage):
+    global running_command_count
+    with command_usage_lock:
+        exclusive = usage_before["exclusive"] and running_command_count == 1
+        running_command_count -= 1
+        usage_after = read_children_rusage()
+
+    cpu_time = sum(sampled_usage["processes"].values())
+    peak_rss = sampled_usage["peak_rss"]
+    if exclusive and usage_before["rusage"] is not None and usage_after is not None:
+        # Nothing else ran meanwhile, so the children rusage delta belongs to this command and is exact
+        cpu_time = max(cpu_time, usage_after[0] - usage_before["rusage"][0])
+        if usage_after[1] > usage_before["rusage"][1]:
+            peak_rss = max(peak_rss, usage_after[1])
+
+    step_metrics = current_step_metrics.get()
+    if step_metrics is not None:
+        step_metrics["cpu_time"] += cpu_time
+        step_metrics["peak_rss"] = max(step_metrics["peak_rss"], peak_rss)
+
+def roll_up_project_metrics(project_metrics, duration):
+    project_metrics["duration"] = duration
+    project_metrics["cpu_time"] = sum(step_metrics["cpu_time"] for step_metrics in project_metrics["steps"])
+    project_metrics["peak_rss"] = max((step_metrics["peak_rss"] for step_metrics in project_metrics["steps"]), default=0)
+    project_metrics["status"] = "succeeded" if all(step_metrics["status"] in ("succeeded", "up to date") for step_metrics in project_metrics["steps"]) else "failed"
+
+def write_metrics_report(projects_metrics, metrics_path):
+    report = {
+        "duration": max((metrics["start"] + metrics["duration"] for metrics in projects_metrics), default=0)
+                    - min((metrics["start"] for metrics in projects_metrics), default=0),
+        "cpu_time": sum(metrics["cpu_time"] for metrics in projects_metrics),
+        "peak_rss": max((metrics["peak_rss"] for metrics in projects_metrics), default=0),
+        "projects": projects_metrics,
+    }
+    with open(metrics_path, "w", encoding="utf-8") as metrics_file:
+        json.dump(report, metrics_file, indent=2)
+
+def write_trace_file(projects_metrics, trace_path):
+    # Chrome trace-event format: one trace process per project, one thread per step
+    trace_start = min((metrics["start"] for metrics in projects_metrics), default=0)
+    trace_events = []
+    for process_id, metrics in enumerate(projects_metrics, start=1):
+        trace_events.append({"name": "process_name", "ph": "M", "pid": process_id, "args": {"name": metrics["name"]}})
+        for thread_id, step_metrics in enumerate(metrics["steps"], start=1):
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": process_id, "tid": thread_id, "args": {"name": step_metrics["name"]}})
+            trace_events.append({
+                "name": step_metrics["name"],
+                "cat": "step",
+                "ph": "X",
+                "pid": process_id,
+                "tid": thread_id,
+                "ts": round((step_metrics["start"] - trace_start) * 1e6),
+                "dur": round(step_metrics["duration"] * 1e6),
+                "args": {"status": step_metrics["status"], "cpu_time": step_metrics["cpu_time"], "peak_rss": step_metrics["peak_rss"]},
+            })
+    with open(trace_path, "w", encoding="utf-8") as trace_file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file)
+
+################################################################
+# Resource scheduler
+
+def get_available_cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))  # Honours CPU pinning of containers and CI agents
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_available_memory():
+    if psutil is not None:
+        available_memory = psutil.virtual_memory().available
+    else:
+        try:
+            with open("/proc/meminfo", encoding="ascii") as meminfo_file:
+                available_memory = next(int(line.split()[1]) * 1024 for line in meminfo_file if line.startswith("MemAvailable:"))
+        except (OSError, StopIteration):
+            return None  # Unknown (Windows without psutil): only the core count limits builds
+
+    # A container's memory limit can be far below what the host reports
+    try:
+        with open("/sys/fs/cgroup/memory.max", encoding="ascii") as limit_file, open("/sys/fs/cgroup/memory.current", encoding="ascii") as usage_file:
+            memory_limit = limit_file.read().strip()
+            if memory_limit != "max":
+                available_memory = min(available_memory, int(memory_limit) - int(usage_file.read()))
+    except (OSError, ValueError):
+        pass
+    return max(available_memory, 0)
+
+def make_resource_scheduler(concurrent_projects=1):
+    cpu_count = get_available_cpu_count()
+    available_memory = get_available_memory()
+    heavy_limit = scheduler_settings["max_heavy_steps"]
+    if heavy_limit is None:
+        heavy_limit = cpu_count // HEAVY_STEP_CORES
+        if available_memory is not None:
+            heavy_limit = min(heavy_limit, available_memory // HEAVY_STEP_MEMORY)
+    heavy_limit = max(1, min(heavy_limit, concurrent_projects))
+    return {"cpu_count": cpu_count, "memory": available_memory or 0, "heavy_limit": heavy_limit, "running": 0, "changed": asyncio.Event()}
+
+def has_room_for_heavy_step(scheduler):
+    if scheduler["running"] == 0:
+        return True  # Always let one build through, however little memory is left
+    if scheduler["running"] >= scheduler["heavy_limit"]:
+        return False
+    available_memory = get_available_memory()
+    return available_memory is None or available_memory >= HEAVY_STEP_MEMORY
+
+async def acquire_heavy_slot(scheduler, step_name, log_prefix=""):
+    # Everything between the check and the increment is synchronous, so the event loop needs no lock here
+    start_time = time.perf_counter()
+    if not has_room_for_heavy_step(scheduler):
+        print(f"{log_prefix}Step '{step_name}' is waiting for CPU and memory ({scheduler['running']} of {scheduler['heavy_limit']} build/run steps running)")
+    while not has_room_for_heavy_step(scheduler):
+        try:
+            await asyncio.wait_for(scheduler["changed"].wait(), MEMORY_RECHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass  # Memory can be freed by other processes without a step finishing
+    scheduler["running"] += 1
+    return time.perf_counter() - start_time
+
+def release_heavy_slot(scheduler):
+    # Synchronous, so a cancelled step can never keep its slot; setting and replacing the event wakes everyone waiting on it
+    scheduler["running"] -= 1
+    scheduler["changed"].set()
+    scheduler["changed"] = asyncio.Event()
+
+def get_binary_log_arguments(step, step_metrics, journal):
+    if not output_settings["binary_logs"] or journal is None or len(step["command"]) < 2 or step["command"][0] != "dotnet" or step["command"][1] not in MSBUILD_COMMANDS:
+        return []
+    # Quiet and JSON runs keep the console to errors and put the full build in a binary log (open it with MSBuild Structured Log Viewer)
+    log_directory = os.path.join(journal["project_directory"], JOURNAL_DIRECTORY, BINARY_LOG_DIRECTORY)
+    os.makedirs(log_directory, exist_ok=True)
+    step_metrics["binary_log"] = os.path.join(log_directory, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', step['name'])}.binlog")
+    return [f"-bl:{step_metrics['binary_log']}", "-v:quiet", "-nologo"]
+
+def get_msbuild_arguments(command, scheduler):
+    if scheduler is None or len(command) < 2 or command[0] != "dotnet" or command[1] not in MSBUILD_COMMANDS:
+        return []
+    # Builds running side by side split the cores between them. Reused MSBuild nodes would stay behind holding memory that the
+    # other builds need, so they are only kept when builds run one at a time and the next build can use the warm nodes.
+    return [f"-maxcpucount:{max(1, scheduler['cpu_count'] // scheduler['heavy_limit'])}",
+            f"-nodeReuse:{'true' if scheduler['heavy_limit'] == 1 else 'false'}"]
+
+################################################################
+# Test stage
+
+def add_test_project(project_name, layout_projects=None, template="console"):
+    # --tests on a solution without a test project adds an xunit project that references every project in it
+    if layout_projects is None:
+        layout_projects = [{"name": project_name, "template": template, "references": []}]
+    test_project_name = f"{project_name}.Tests"
+    if any(project["template"] in TEST_TEMPLATES or project["name"] == test_project_name for project in layout_projects):
+        return layout_projects
+    return layout_projects + [{"name": test_project_name, "template": TEST_PROJECT_TEMPLATE, "references": [project["name"] for project in layout_projects]}]
+
+def get_test_directory(solution_directory_path, test_project_name):
+    return os.path.join(solution_directory_path, JOURNAL_DIRECTORY, TEST_DIRECTORY, test_project_name)
+
+def read_test_timings(test_directory):
+    try:
+        with open(os.path.join(test_directory, TEST_TIMINGS_FILE), encoding="utf-8") as timings_file:
+            test_timings = json.load(timings_file)
+        return test_timings["tests"] if test_timings.get("version") == TEST_TIMINGS_VERSION else {}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def write_test_timings(test_directory, test_timings):
+    os.makedirs(test_directory, exist_ok=True)
+    timings_path = os.path.join(test_directory, TEST_TIMINGS_FILE)
+    with open(f"{timings_path}.tmp", "w", encoding="utf-8") as timings_file:
+        json.dump({"version": TEST_TIMINGS_VERSION, "tests": test_timings}, timings_file, indent=2)
+    os.replace(f"{timings_path}.tmp", timings_path)
+
+def get_test_shard_count(test_timings):
+    if test_settings["shards"] is not None:
+        return max(1, test_settings["shards"])
+    if sum(test["duration"] for test in test_timings.values()) < TEST_SHARD_MIN_DURATION:
+        return 1  # Short or never-run suites: another test host would cost more than it saves
+    scheduler = heavy_step_scheduler.get()
+    cpu_count = scheduler["cpu_count"] // scheduler["heavy_limit"] if scheduler is not None else get_available_cpu_count()
+    return max(1, cpu_count // TEST_SHARD_CORES)
+
+def plan_test_shards(test_timings, shard_count, partition="class", listed_tests=None):
+    # Past time per class (or per method, which adds up a theory's cases), longest first onto the least loaded shard
+    unit_durations = {}
+    for test in test_timings.values():
+        unit_durations[test[partition]] = unit_durations.get(test[partition], 0.0) + test["duration"]
+    if listed_tests:
+        # Units added since the last run get the average past time, so every test is in exactly one shard's filter; removed units are dropped
+        average_duration = sum(unit_durations.values()) / len(unit_durations) if unit_durations else 1.0
+        unit_durations = {test[partition]: unit_durations.get(test[partition], average_duration) for test in listed_tests.values()}
+    shards = [{"units": [], "duration": 0.0} for _ in range(shard_count)]
+    for unit, duration in sorted(unit_durations.items(), key=lambda item: (-item[1], item[0])):
+        shard = min(shards, key=lambda shard: (shard["duration"], len(shard["units"])))  # Ties, such as tests that all took 0.0s, go by unit count
+        shard["units"].append(unit)
+        shard["duration"] += duration
+    return [shard for shard in shards if shard["units"]]
+
+async def discover_tests(project_path, log_prefix="", log_file=None):
+    # The tests there are now, so new ones get a shard of their own and a fresh scaffold can be split at all
+    output_lines = []
+    try:
+        await execute_single_command(["dotnet", "test", project_path, "--no-build", "--list-tests"], log_prefix, output_lines.append, log_file)
+    except CommandFailedError:
+        return {}
+    listed_names = output_lines[next((index + 1 for index, line in enumerate(output_lines) if "The following Tests are available" in line), len(output_lines)):]
+    discovered_tests = {}
+    for listed_name in listed_names:
+        test_name = listed_name.strip()
+        method_name = re.sub(r"\(.*$", "", test_name)  # Theory cases carry their arguments
+        class_name = method_name.rpartition(".")[0]
+        if test_name and class_name and " " not in method_name:  # mstest and nunit list bare method names, which no class filter can select
+            discovered_tests[test_name] = {"class": class_name, "method": method_name, "duration": 1.0}
+    return discovered_tests
+
+def get_test_filter_term(unit, partition="class", negate=False):
+    escaped_unit = re.sub(r"([\\()&|=!~])", r"\\\1", unit)  # Characters with a meaning in dotnet test --filter
+    if partition == "class":
+        return f"FullyQualifiedName{'!~' if negate else '~'}{escaped_unit}."  # The dot keeps Class1 from matching Class10
+    return f"FullyQualifiedName{'!=' if negate else '='}{escaped_unit}"
+
+def get_test_shard_filters(shards, partition="class", include_unknown=False):
+    shard_filters = ["|".join(get_test_filter_term(unit, partition) for unit in shard["units"]) for shard in shards]
+    if not include_unknown:
+        return shard_filters
+    # Without a test list, tests added since the last run are in no shard yet, so the lightest shard also runs everything the history does not know
+    unknown_tests_filter = "&".join(get_test_filter_term(unit, partition, negate=True) for shard in shards for unit in shard["units"])
+    lightest_shard = min(range(len(shards)), key=lambda shard_index: shards[shard_index]["duration"])
+    shard_filters[lightest_shard] = f"({shard_filters[lightest_shard]})|({unknown_tests_filter})"
+    return shard_filters
+
+def parse_trx_duration(duration):
+    hours, minutes, seconds = (duration or "0:0:0").split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def read_trx_results(trx_path):
+    namespaces = {"trx": TRX_NAMESPACE}
+    trx_root = ElementTree.parse(trx_path).getroot()
+    test_methods = {unit_test.get("id"): unit_test.find("trx:TestMethod", namespaces) for unit_test in trx_root.iterfind("trx:TestDefinitions/trx:UnitTest", namespaces)}
+    test_results = []
+    for unit_test_result in trx_root.iterfind("trx:Results/trx:UnitTestResult", namespaces):
+        test_name = unit_test_result.get("testName")
+        test_method = test_methods.get(unit_test_result.get("testId"))
+        if test_method is not None:
+            class_name = test_method.get("className").split(",")[0].strip()  # Some adapters write the assembly-qualified name
+            method_name = re.sub(r"\(.*$", "", test_method.get("name"))  # Theory cases carry their arguments
+        else:
+            class_name, _, method_name = re.sub(r"\(.*$", "", test_name).rpartition(".")
+        if not method_name.startswith(f"{class_name}."):
+            method_name = f"{class_name}.{method_name}"
+        error_info = unit_test_result.find("trx:Output/trx:ErrorInfo", namespaces)
+        test_results.append({"name": test_name, "class": class_name, "method": method_name, "outcome": unit_test_result.get("outcome"),
+                             "duration": parse_trx_duration(unit_test_result.get("duration")),
+                             "message": error_info.findtext("trx:Message", "", namespaces) if error_info is not None else "",
+                             "stack_trace": error_info.findtext("trx:StackTrace", "", namespaces) if error_info is not None else ""})
+    return test_results
+
+def merge_trx_files(trx_paths, merged_path):
+    # One TRX for the whole run: the first shard's file with the other shards' results, definitions and counters added in
+    namespaces = {"trx": TRX_NAMESPACE}
+    ElementTree.register_namespace("", TRX_NAMESPACE)
+    merged_tree = ElementTree.parse(trx_paths[0])
+    merged_root = merged_tree.getroot()
+    merged_counters = merged_root.find("trx:ResultSummary/trx:Counters", namespaces)
+    for trx_path in trx_paths[1:]:
+        trx_root = ElementTree.parse(trx_path).getroot()
+        for section_name in ("Results", "TestDefinitions", "TestEntries"):
+            section = trx_root.find(f"trx:{section_name}", namespaces)
+            merged_section = merged_root.find(f"trx:{section_name}", namespaces)
+            if section is None:
+                continue
+            if merged_section is None:
+                merged_root.append(section)
+            else:
+                merged_section.extend(list(section))
+        counters = trx_root.find("trx:ResultSummary/trx:Counters", namespaces)
+        if counters is not None and merged_counters is not None:
+            for name, value in counters.attrib.items():
+                if value.isdigit():
+                    merged_counters.set(name, str(int(merged_counters.get(name, "0")) + int(value)))
+        times = trx_root.find("trx:Times", namespaces)
+        merged_times = merged_root.find("trx:Times", namespaces)
+        if times is not None and merged_times is not None:  # ISO timestamps in the same format compare as text
+            merged_times.set("start", min(merged_times.get("start", ""), times.get("start", "")) or times.get("start", ""))
+            merged_times.set("finish", max(merged_times.get("finish", ""), times.get("finish", "")))
+    result_summary = merged_root.find("trx:ResultSummary", namespaces)
+    if result_summary is not None and merged_counters is not None and any(int(merged_counters.get(name, "0")) for name in ("failed", "error", "timeout", "aborted")):
+        result_summary.set("outcome", "Failed")
+    os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+    merged_tree.write(merged_path, encoding="utf-8", xml_declaration=True)
+
+def write_junit_report(test_results, junit_path, suite_name):
+    def count_outcomes(results):
+        failed = sum(1 for result in results if result["outcome"] in TRX_FAILED_OUTCOMES)
+        skipped = sum(1 for result in results if result["outcome"] != "Passed" and result["outcome"] not in TRX_FAILED_OUTCOMES)
+        return {"tests": str(len(results)), "failures": str(failed), "skipped": str(skipped), "time": f"{sum(result['duration'] for result in results):.3f}"}
+
+    test_classes = {}
+    for result in test_results:
+        test_classes.setdefault(result["class"], []).append(result)
+    junit_root = ElementTree.Element("testsuites", name=suite_name, **count_outcomes(test_results))
+    for class_name, class_results in sorted(test_classes.items()):
+        test_suite = ElementTree.SubElement(junit_root, "testsuite", name=class_name, **count_outcomes(class_results))
+        for result in class_results:
+            test_case = ElementTree.SubElement(test_suite, "testcase", name=result["name"], classname=class_name, time=f"{result['duration']:.3f}")
+            if result["outcome"] in TRX_FAILED_OUTCOMES:
+                ElementTree.SubElement(test_case, "failure", message=result["message"], type=result["outcome"]).text = result["stack_trace"]
+            elif result["outcome"] != "Passed":
+                ElementTree.SubElement(test_case, "skipped", message=result["outcome"])
+    os.makedirs(os.path.dirname(junit_path), exist_ok=True)
+    ElementTree.ElementTree(junit_root).write(junit_path, encoding="utf-8", xml_declaration=True)
+
+async def run_test_project(project_path, solution_directory_path, log_prefix="", log_file=None, output_callback=None):
+    test_project_name = os.path.splitext(os.path.basename(project_path))[0]
+    test_directory = get_test_directory(solution_directory_path, test_project_name)
+    shard_directory = os.path.join(test_directory, TEST_SHARD_DIRECTORY)
+    shutil.rmtree(shard_directory, ignore_errors=True)  # A shard that crashes must not leave an older run's results behind
+    test_timings = read_test_timings(test_directory)
+    shard_count = get_test_shard_count(test_timings)
+    partition = test_settings["partition"]
+    unit_names = "classes" if partition == "class" else "methods"
+    # mstest and nunit list bare method names, so their new tests can only be caught by the history's negated filter
+    listed_tests = await discover_tests(project_path, log_prefix, log_file) if shard_count > 1 else {}
+    shards = plan_test_shards(test_timings, shard_count, partition, listed_tests)
+    if test_settings["shards"] is not None and len(shards) < shard_count:
+        print(f"{log_prefix}Warning: --test-shards {shard_count} ignored for {test_project_name}: only {len(shards)} of its test {unit_names} "
+              f"could be found, so it runs in {max(1, len(shards))} shards")
+    shard_filters = get_test_shard_filters(shards, partition, include_unknown=not listed_tests) if len(shards) > 1 else [None]
+    if max(len(shard_filter or "") for shard_filter in shard_filters) > TEST_FILTER_LENGTH_LIMIT:
+        print(f"{log_prefix}Running {test_project_name} in one shard: its shard filters would be longer than {TEST_FILTER_LENGTH_LIMIT} characters"
+              + (" (--test-partition class makes them shorter)" if partition == "method" else ""))
+        shard_filters = [None]
+    if len(shard_filters) > 1:
+        shard_size = (f"{max(shard['duration'] for shard in shards):.1f}s each, from the last run's timings" if test_timings
+                      else f"{max(len(shard['units']) for shard in shards)} test {unit_names} each, from the listed tests")
+        print(f"{log_prefix}Running {test_project_name} in {len(shard_filters)} shards of about {shard_size} (by {partition})")
+
+    trx_paths = [os.path.join(shard_directory, f"shard-{shard_number}.trx") for shard_number in range(1, len(shard_filters) + 1)]
+    shard_commands = []
+    for trx_path, shard_filter in zip(trx_paths, shard_filters):
+        shard_commands.append(["dotnet", "test", project_path, "--no-build", "--results-directory", shard_directory, "--logger", f"trx;LogFileName={os.path.basename(trx_path)}"]
+                              + (["--filter", shard_filter] if shard_filter is not None else []))
+    shard_prefixes = [f"{log_prefix}[shard {shard_number}] " if len(shard_commands) > 1 else log_prefix for shard_number in range(1, len(shard_commands) + 1)]
+    shard_errors = await asyncio.gather(*(execute_single_command(command, shard_prefix, output_callback, log_file) for command, shard_prefix in zip(shard_commands, shard_prefixes)),
+                                        return_exceptions=True)
+    for shard_error in shard_errors:
+        if shard_error is not None and not isinstance(shard_error, CommandFailedError):
+            raise shard_error
+
+    # Failed tests make their shard exit with an error, but their results are still merged and reported
+    written_trx_paths = [trx_path for trx_path in trx_paths if os.path.isfile(trx_path)]
+    test_results = [result for trx_path in written_trx_paths for result in read_trx_results(trx_path)]
+    results_directory = os.path.join(solution_directory_path, TEST_RESULTS_DIRECTORY)
+    if written_trx_paths:
+        merge_trx_files(written_trx_paths, os.path.join(results_directory, f"{test_project_name}.trx"))
+        write_junit_report(test_results, os.path.join(results_directory, f"{test_project_name}.junit.xml"), test_project_name)
+        new_timings = {result["name"]: {"class": result["class"], "method": result["method"], "duration": round(result["duration"], 4)} for result in test_results}
+        # A complete run replaces the history, so removed tests stop getting shards; after a crashed shard, only what ran is updated
+        write_test_timings(test_directory, new_timings if len(written_trx_paths) == len(trx_paths) else {**test_timings, **new_timings})
+
+    failed_count = sum(1 for result in test_results if result["outcome"] in TRX_FAILED_OUTCOMES)
+    passed_count = sum(1 for result in test_results if result["outcome"] == "Passed")
+    step_metrics = current_step_metrics.get()
+    if step_metrics is not None:
+        step_metrics["tests"] = {"passed": passed_count, "failed": failed_count, "skipped": len(test_results) - passed_count - failed_count, "shards": len(shard_commands)}
+    print(f"{log_prefix}{test_project_name}: {passed_count} passed, {failed_count} failed, {len(test_results) - passed_count - failed_count} skipped"
+          + (f"; results in {os.path.join(results_directory, test_project_name)}.trx and .junit.xml" if written_trx_paths else ""))
+    if failed_count:
+        raise CommandFailedError(f"{failed_count} of {len(test_results)} tests failed in {test_project_name}.")
+    if any(shard_error is not None for shard_error in shard_errors):
+        raise CommandFailedError(f"The test run of {test_project_name} failed.")
+
+################################################################
+# Startup measurement
+
+def get_runtime_identifier():
+    architecture = platform.machine().lower()
+    architecture = {"x86_64": "x64", "amd64": "x64", "aarch64": "arm64", "armv7l": "arm", "i386": "x86", "i686": "x86"}.get(architecture, architecture)
+    if os.name == "nt":
+        return f"win-{architecture}"
+    if sys.platform == "darwin":
+        return f"osx-{architecture}"
+    try:
+        is_musl = any(name.startswith("ld-musl-") for name in os.listdir("/lib"))  # Alpine and other musl distributions need their own runtime
+    except OSError:
+        is_musl = False
+    return f"linux-musl-{architecture}" if is_musl else f"linux-{architecture}"
+
+def read_project_property(project_path, property_name):
+    try:
+        with open(project_path, encoding="utf-8-sig") as project_file:
+            property_match = re.search(rf"<{property_name}>\s*([^<]+?)\s*</{property_name}>", project_file.read())
+    except OSError:
+        return None
+    return property_match.group(1) if property_match else None
+
+def get_native_aot_problem(target_framework, sdk_version):
+    framework_version = re.match(r"^net(\d+)\.\d+$", target_framework or "")
+    if framework_version is None or int(framework_version.group(1)) < 7 or int(sdk_version.split(".")[0]) < 7:
+        return "Native AOT needs a .NET 7 or newer SDK and target framework"
+    if os.name != "nt" and shutil.which("clang") is None:
+        return "Native AOT needs clang to link the executable"  # Windows looks for the Visual Studio C++ tools itself
+    return None
+
+def get_launch_command(publish_directory, assembly_name):
+    app_host_path = os.path.join(publish_directory, assembly_name + (".exe" if os.name == "nt" else ""))
+    if os.path.isfile(app_host_path):
+        return [app_host_path]
+    return ["dotnet", os.path.join(publish_directory, f"{assembly_name}.dll")]  # Published without an app host
+
+def wait_for_launch(process):
+    # wait4 returns the peak memory of this one process; children rusage would mix in every earlier launch
+    if hasattr(os, "wait4"):
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        end_time = time.perf_counter()
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+        return end_time, usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    process.wait()
+    return time.perf_counter(), None
+
+async def measure_launch(command):
+    # The generated app prints one line and exits, so its run time is its startup time
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=get_command_environment(),
+                               **get_process_group_options())
+    try:
+        end_time, peak_rss = await asyncio.to_thread(wait_for_launch, process)
+    finally:
+        if process.returncode is None:  # Timed out or cancelled; killing it also ends the waiting thread
+            kill_process_tree(process)
+    if process.returncode != 0:
+        raise CommandFailedError(f"{format_command(command)} exited with code {process.returncode}")
+    return end_time - start_time, peak_rss
+
+async def publish_startup_variant(report, command, publish_directory, assembly_name, log_prefix="", log_file=None, output_callback=None):
+    output_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    def collect_output(line):
+        output_tail.append(line)
+        if output_callback is not None:
+            output_callback(line)
+
+    start_time = time.perf_counter()
+    try:
+        await execute_single_command(command, log_prefix, collect_output, log_file)
+    except CommandFailedError:
+        error_lines = [line.partition(": error ")[2].strip() for line in output_tail if ": error " in line]  # Without the project path in front
+        raise CommandFailedError(f"dotnet publish failed: {error_lines[-1] if error_lines else 'see the output above'}")
+    report["publish_seconds"] = round(time.perf_counter() - start_time, 3)
+    report["size"] = await asyncio.to_thread(get_directory_size, publish_directory)
+    launch_command = get_launch_command(publish_directory, assembly_name)
+    for _ in range(startup_settings["runs"]):
+        try:
+            duration, peak_rss = await asyncio.wait_for(measure_launch(launch_command), RUN_STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CommandFailedError(f"The published app did not exit within {RUN_STEP_TIMEOUT} seconds")
+        report["launches_ms"].append(round(duration * 1000, 1))
+        if peak_rss is not None:
+            report["peak_rss"] = max(report["peak_rss"] or 0, peak_rss)
+    report["cold_ms"] = report["launches_ms"][0]  # The first launch of a fresh artifact: nothing of it is in the OS's caches yet but the files just written
+    report["warm_ms"] = statistics.median(report["launches_ms"][1:] or report["launches_ms"])
+
+def write_startup_report(report_path, startup_report):
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(f"{report_path}.tmp", "w", encoding="utf-8") as report_file:
+        json.dump(startup_report, report_file, indent=2)
+    os.replace(f"{report_path}.tmp", report_path)
+
+def print_startup_report(startup_report, log_prefix=""):
+    print(f"{log_prefix}Startup of {startup_report['project']} ({startup_report['runs']} launches each, {startup_report['runtime_identifier']}):")
+    print(f"{log_prefix}  {'variant':<10}{'cold':>10}{'warm':>10}{'peak rss':>11}{'size':>12}{'publish':>10}")
+    for report in startup_report["variants"]:
+        if report["status"] == "measured":
+            print(f"{log_prefix}  {report['variant']:<10}{report['cold_ms']:>8.1f}ms{report['warm_ms']:>8.1f}ms{format_memory(report['peak_rss']):>11}"
+                  f"{report['size'] / (1024 * 1024):>8.1f} MiB{report['publish_seconds']:>9.1f}s")
+        else:
+            print(f"{log_prefix}  {report['variant']:<10}  {report['status']}: {report['error']}")
+
+async def measure_startup_variants(project_path, solution_directory_path, log_prefix="", log_file=None, output_callback=None):
+    app_name = os.path.splitext(os.path.basename(project_path))[0]
+    startup_directory = os.path.join(solution_directory_path, JOURNAL_DIRECTORY, STARTUP_DIRECTORY)
+    target_framework = read_project_property(project_path, "TargetFramework")
+    assembly_name = read_project_property(project_path, "AssemblyName") or app_name
+    runtime_identifier = get_runtime_identifier()
+    sdk_version = await asyncio.to_thread(get_dotnet_sdk_version, solution_directory_path)
+    scheduler = heavy_step_scheduler.get()
+
+    # The variants publish one after another inside this step's build slot, so the launches are not timed next to a running build
+    startup_report = {"project": app_name, "runtime_identifier": runtime_identifier, "runs": startup_settings["runs"], "variants": []}
+    report_path = os.path.join(startup_directory, f"{app_name}.json")
+    step_metrics = current_step_metrics.get()
+    if step_metrics is not None:
+        step_metrics["startup"] = startup_report["variants"]  # Filled in as the variants finish, so a failed step still reports them
+    for variant in startup_settings["variants"]:
+        report = {"variant": variant, "status": "running", "error": None, "publish_seconds": None, "size": None, "cold_ms": None, "warm_ms": None,
+                  "peak_rss": None, "launches_ms": []}
+        startup_report["variants"].append(report)
+        variant_problem = get_native_aot_problem(target_framework, sdk_version) if variant == "aot" else None
+        if variant_problem is not None:
+            report.update(status="skipped", error=variant_problem)
+            print(f"{log_prefix}Skipping startup variant '{variant}': {variant_problem}")
+            await asyncio.to_thread(write_startup_report, report_path, startup_report)
+            continue
+
+        publish_directory = os.path.join(startup_directory, app_name, variant)
+        await asyncio.to_thread(shutil.rmtree, publish_directory, True)  # Files of an earlier publish would count towards the size
+        command = (["dotnet", "publish", project_path, "-c", "Release", "-o", publish_directory] + (["-r", runtime_identifier] if variant != "fdd" else [])
+                   + STARTUP_VARIANTS[variant])
+        try:
+            # A variant the machine cannot build (no runtime pack offline, no native toolchain) or that takes too long is reported, not fatal
+            await asyncio.wait_for(publish_startup_variant(report, command + get_msbuild_arguments(command, scheduler), publish_directory, assembly_name,
+                                                           log_prefix, log_file, output_callback), STARTUP_VARIANT_TIMEOUT)
+            report["status"] = "measured"
+        except asyncio.TimeoutError:
+            report.update(status="failed", error=f"Publishing and launching took longer than {STARTUP_VARIANT_TIMEOUT} seconds")
+            print(f"{log_prefix}Startup variant '{variant}' failed: {report['error']}")
+        except (CommandFailedError, OSError) as e:
+            report.update(status="failed", error=str(e))
+            print(f"{log_prefix}Startup variant '{variant}' failed: {e}")
+        await asyncio.to_thread(write_startup_report, report_path, startup_report)  # Variants already measured survive a step that is stopped later
+
+    print_startup_report(startup_report, log_prefix)
+    print(f"{log_prefix}Startup report: {report_path}")
+    if not any(report["status"] == "measured" for report in startup_report["variants"]):
+        raise CommandFailedError(f"No startup variant of {app_name} could be published and measured.")
+
+################################################################
+# Batch mode
+
+def read_batch_manifest(manifest_path, default_template="console", default_framework=None, default_scaffold="dotnet", default_layout=None):
+    entries = read_structured_file(manifest_path)
+    if isinstance(entries, dict):
+        entries = entries.get("projects", [])
+
+    projects = []
+    seen_directories = set()
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        project_name = (entry.get("name") or "").strip()
+        validate_project_name(project_name)
+
+        project = {
+            "name": project_name,
+            "directory": os.path.abspath(entry.get("directory") or os.getcwd()),
+            "template": entry.get("template") or default_template,
+            "framework": entry.get("framework") or default_framework,
+            "scaffold": entry.get("scaffold") or default_scaffold,
+            "layout": entry.get("layout") or default_layout,
+        }
+        if project["scaffold"] not in SCAFFOLD_MODES:
+            raise ValueError(f"Invalid scaffold mode '{project['scaffold']}' for project '{project_name}'.")
+        get_layout_projects(project_name, project["layout"], project["template"])  # Reject a bad layout before anything runs
+
+        project_directory_path = os.path.normcase(os.path.join(project["directory"], project_name))
+        if project_directory_path in seen_directories:
+            raise ValueError(f"Duplicate project '{project_name}' in manifest.")
+        seen_directories.add(project_directory_path)
+        projects.append(project)
+
+    if not projects:
+        raise ValueError(f"No projects found in manifest: {manifest_path}")
+    return projects
+
+async def scaffold_batch_project(project, job_slots, log_directory=None, step_timeout=None, force=False, event_callback=None):
+    async with job_slots:
+        start_time = time.perf_counter()
+        result = dict(project, status="succeeded", error=None)
+        project_metrics = {}
+        try:
+            await run_project_pipeline(project["name"], project["directory"], project["template"], project["framework"],
+                                       log_prefix=f"[{project['name']}] ", log_directory=log_directory, scaffold=project["scaffold"], step_timeout=step_timeout,
+                                       event_callback=event_callback, project_metrics=project_metrics, force=force, layout=project.get("layout"))
+        except Exception as e:  # A failed project must not stop the rest of the batch
+            result["status"] = "failed"
+            result["error"] = str(e)
+        result["duration"] = round(time.perf_counter() - start_time, 3)
+        result["cpu_time"] = round(project_metrics.get("cpu_time", 0.0), 3)
+        result["peak_rss"] = project_metrics.get("peak_rss", 0)
+        result["metrics"] = project_metrics
+        return result
+
+async def run_batch_async(projects, jobs, log_directory=None, step_timeout=None, force=False, event_callback=None):
+    # One event loop supervises every project; the semaphore bounds how many run at once, and the scheduler how many of them build at once
+    job_slots = asyncio.Semaphore(jobs)
+    scheduler = make_resource_scheduler(min(jobs, len(projects)))
+    heavy_step_scheduler.set(scheduler)
+    print(f"Running at most {scheduler['heavy_limit']} build/run steps at once ({scheduler['cpu_count']} cores, {format_memory(scheduler['memory'])} available)")
+    project_tasks = [asyncio.create_task(scaffold_batch_project(project, job_slots, log_directory, step_timeout, force, event_callback)) for project in projects]
+    try:
+        for completed, project_task in enumerate(asyncio.as_completed(project_tasks), start=1):
+            result = await project_task
+            print(f"[{completed}/{len(projects)}] {result['name']}: {result['status']} ({result['duration']:.1f}s)")
+    finally:
+        for project_task in project_tasks:
+            project_task.cancel()
+        await asyncio.gather(*project_tasks, return_exceptions=True)
+    return [project_task.result() for project_task in project_tasks]  # Manifest order
+
+def run_batch(projects, jobs=None, log_directory=None, step_timeout=None, force=False, event_callback=None):
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    print(f"Scaffolding {len(projects)} projects with {jobs} workers...")
+    try:
+        return asyncio.run(run_batch_async(projects, jobs, log_directory, step_timeout, force, event_callback))
+    except KeyboardInterrupt:
+        raise SystemExit("Cancelled. Every command CARPS started was stopped.")
+
+def make_json_event_writer(stream):
+    # JSON lines: one compact object per event, flushed at once so CI tools can follow the run as it happens
+    def write_json_event(event):
+        # Events relayed from a queue worker keep the time they happened there
+        stream.write(json.dumps(dict(event, time=event.get("time", round(time.time(), 3))), separators=(",", ":")) + "\n")
+        stream.flush()
+    return write_json_event
+
+def write_metrics_exports(projects_metrics, metrics_path=None, trace_path=None):
+    if metrics_path:
+        write_metrics_report(projects_metrics, metrics_path)
+    if trace_path:
+        write_trace_file(projects_metrics, trace_path)
+
+def print_batch_report(results):
+    failed = [result for result in results if result["status"] != "succeeded"]
+    print("\nBatch report")
+    print(f"Succeeded: {len(results) - len(failed)}")
+    print(f"Failed: {len(failed)}")
+    for result in failed:
+        print(f"  - {result['name']}: {result['error']}")
+
+def write_batch_report(results, report_path):
+    report = {
+        "total": len(results),
+        "succeeded": sum(1 for result in results if result["status"] == "succeeded"),
+        "failed": sum(1 for result in results if result["status"] != "succeeded"),
+        "projects": [{key: value for key, value in result.items() if key != "metrics"} for result in results],
+    }
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+################################################################
+# Watch mode
+
+def snapshot_watched_files(directory_path):
+    # One stat per file, no hashing: a scan of a project tree takes a few milliseconds, so polling works the same on every OS
+    watched_files = {}
+    pending_directories = [directory_path]
+    while pending_directories:
+        try:
+            with os.scandir(pending_directories.pop()) as directory_entries:
+                entries = list(directory_entries)
+        except OSError:
+            continue  # Removed while scanning; the next scan sees the final state
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in WATCH_IGNORED_DIRECTORIES:
+                        pending_directories.append(entry.path)
+                elif not entry.name.endswith(WATCH_IGNORED_SUFFIXES):
+                    entry_stat = entry.stat()
+                    watched_files[entry.path] = (entry_stat.st_size, entry_stat.st_mtime_ns)
+            except OSError:
+                continue
+    return watched_files
+
+def get_changed_files(old_files, new_files):
+    return {path for path in old_files.keys() | new_files.keys() if old_files.get(path) != new_files.get(path)}
+
+def describe_changed_files(changed_files, directory_path):
+    names = sorted(os.path.relpath(path, directory_path) for path in changed_files)
+    more = f" and {len(names) - WATCH_REPORTED_PATHS} more" if len(names) > WATCH_REPORTED_PATHS else ""
+    return ", ".join(names[:WATCH_REPORTED_PATHS]) + more
+
+async def stop_rebuild(rebuild_task):
+    rebuild_task.cancel()  # Kills the build's commands; the journal then knows the build did not finish
+    await asyncio.gather(rebuild_task, return_exceptions=True)
+
+async def watch_project(project_name, base_directory=None, template="console", framework=None, log_prefix="", log_directory=None, scaffold="dotnet",
+                        step_timeout=None, event_callback=None, layout=None, run=True):
+    # A burst of saves or a checkout becomes one rebuild once the tree has been quiet for WATCH_DEBOUNCE; changes during a rebuild make it stale, so it is cancelled
+    project_directory_path = os.path.join(base_directory or os.getcwd(), project_name)
+    known_files = await asyncio.to_thread(snapshot_watched_files, project_directory_path)
+    changed_files = set()
+    last_change_time = 0.0
+    rebuild_task = None
+    print(f"{log_prefix}Watching {project_directory_path} for changes. Press Ctrl+C to stop.")
+    try:
+        while True:
+            await asyncio.sleep(WATCH_POLL_INTERVAL)
+            current_files = await asyncio.to_thread(snapshot_watched_files, project_directory_path)
+            new_changes = get_changed_files(known_files, current_files)
+            known_files = current_files
+            if new_changes:
+                changed_files.update(new_changes)
+                last_change_time = time.monotonic()
+                if rebuild_task is not None and not rebuild_task.done():
+                    print(f"{log_prefix}Files changed during the rebuild; cancelling it")
+                    await stop_rebuild(rebuild_task)
+                    rebuild_task = None
+
+            if rebuild_task is not None and rebuild_task.done():
+                if rebuild_task.exception() is not None:
+                    print(f"{log_prefix}{rebuild_task.exception()}")
+                print(f"{log_prefix}Waiting for changes...")
+                rebuild_task = None
+            if changed_files and rebuild_task is None and time.monotonic() - last_change_time >= WATCH_DEBOUNCE:
+                print(f"{log_prefix}Changed: {describe_changed_files(changed_files, project_directory_path)}; rebuilding")
+                if event_callback is not None:
+                    event_callback({"type": "changes", "project": project_name, "count": len(changed_files),
+                                    "paths": sorted(os.path.relpath(path, project_directory_path) for path in changed_files)[:WATCH_REPORTED_PATHS]})
+                changed_files = set()
+                # The journal skips the scaffolding, and MSBuild only recompiles what changed
+                rebuild_task = asyncio.create_task(run_project_pipeline(project_name, base_directory, template, framework, log_prefix, log_directory, scaffold,
+                                                                        step_timeout, event_callback=event_callback, layout=layout, run=run))
+    finally:
+        if rebuild_task is not None:
+            await stop_rebuild(rebuild_task)
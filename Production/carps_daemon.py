@@ -0,0 +1,272 @@
+"""
+CARPS daemon
+
+A long-running CARPS that keeps Python, the SDK probe, the golden templates and the .NET build
+servers warm, and scaffolds projects for clients that submit jobs over a localhost HTTP API.
+carps_client.py is the matching thin client; it finds the daemon through the state file it writes.
+"""
+
+
+import asyncio
+import http.server
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from carps_core import (SCAFFOLD_MODES, CommandFailedError, get_carps_cache_directory, get_dotnet_environment, get_golden_template, get_layout_projects,
+                        heavy_step_scheduler, make_resource_scheduler, run_project_pipeline, startup_settings, test_settings, validate_project_name)
+
+DAEMON_HOST = "127.0.0.1"  # Only local clients; the API can build in any folder the daemon's user can write
+DAEMON_STATE_FILE = "daemon.json"  # In the CARPS cache: the daemon's address, process ID and access token
+JOB_HISTORY_LIMIT = 200  # Finished jobs kept for clients to read back
+JOB_WAIT_LIMIT = 60  # Longest a client's request waits for a job to finish, in seconds
+FINISHED_JOB_STATUSES = ("succeeded", "failed", "cancelled")
+
+def get_daemon_state_path():
+    return os.path.join(get_carps_cache_directory(), DAEMON_STATE_FILE)
+
+def write_daemon_state(daemon_state):
+    state_path = get_daemon_state_path()
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    temporary_path = f"{state_path}.{os.getpid()}.tmp"
+    # Only the daemon's user may read the token
+    with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as state_file:
+        json.dump(daemon_state, state_file, indent=2)
+    os.replace(temporary_path, state_path)
+
+def remove_daemon_state(token):
+    try:
+        with open(get_daemon_state_path(), encoding="utf-8") as state_file:
+            if json.load(state_file).get("token") != token:
+                return  # A newer daemon has taken over
+        os.remove(get_daemon_state_path())
+    except (OSError, ValueError):
+        pass
+
+def get_job_summary(job):
+    return {key: value for key, value in job.items() if key not in ("done", "task")}
+
+def make_daemon_job(request, defaults):
+    # Same fields as a batch manifest entry, plus force and build; the directory must be absolute since the client's cwd is not ours
+    if not isinstance(request, dict):
+        raise ValueError("The job must be a JSON object.")
+    for field in ("name", "directory", "template", "framework", "scaffold", "layout"):
+        if request.get(field) is not None and not isinstance(request[field], str):
+            raise ValueError(f"The job's '{field}' must be a string.")
+    project = {
+        "name": (request.get("name") or "").strip(),
+        "directory": request.get("directory"),
+        "template": request.get("template") or defaults["template"],
+        "framework": request.get("framework") or defaults["framework"],
+        "scaffold": request.get("scaffold") or defaults["scaffold"],
+        "layout": request.get("layout"),
+    }
+    validate_project_name(project["name"])
+    if not project["directory"] or not os.path.isabs(project["directory"]):
+        raise ValueError("The job needs an absolute 'directory'.")
+    if project["scaffold"] not in SCAFFOLD_MODES:
+        raise ValueError(f"Invalid scaffold mode '{project['scaffold']}'.")
+    get_layout_projects(project["name"], project["layout"], project["template"])
+    return {"id": uuid.uuid4().hex[:12], "project": project, "force": bool(request.get("force")), "build": request.get("build", True) is not False,
+            "status": "queued", "submitted": time.time(), "started": None, "duration": None, "error": None, "directory": None, "events": [],
+            "done": threading.Event(), "task": None}
+
+def submit_daemon_job(daemon, job):
+    # Called on an HTTP thread: the job list is shared under the lock, and the queue belongs to the event loop
+    with daemon["lock"]:
+        finished_jobs = [job_id for job_id, old_job in daemon["jobs"].items() if old_job["status"] in FINISHED_JOB_STATUSES]
+        for job_id in finished_jobs[:max(0, len(finished_jobs) - JOB_HISTORY_LIMIT + 1)]:
+            del daemon["jobs"][job_id]
+        daemon["jobs"][job["id"]] = job
+    daemon["loop"].call_soon_threadsafe(daemon["queue"].put_nowait, job)
+
+def cancel_daemon_job(daemon, job):
+    # Decided on the event loop, where workers take jobs and start their tasks, so a job is either skipped or its running task is cancelled
+    async def cancel_job():
+        if job["status"] == "queued":
+            job.update(status="cancelled", started=time.time(), duration=0.0)  # The worker skips it
+            job["done"].set()
+        elif job["status"] == "running":
+            job["task"].cancel()  # Kills the job's running commands and their children
+
+    asyncio.run_coroutine_threadsafe(cancel_job(), daemon["loop"]).result()
+    job["done"].wait(JOB_WAIT_LIMIT)  # The reply shows how the job ended, which may still be a success if it finished first
+
+async def run_daemon_job(daemon, job):
+    project = job["project"]
+    job.update(status="running", started=time.time())
+    print(f"[{job['id']}] Scaffolding {project['name']} in {project['directory']}")
+    job["task"] = asyncio.create_task(run_project_pipeline(project["name"], project["directory"], project["template"], project["framework"],
+                                                           log_prefix=f"[{project['name']}] ", log_directory=daemon["log_directory"], scaffold=project["scaffold"],
+                                                           step_timeout=daemon["step_timeout"], force=job["force"],
+                                                           event_callback=lambda event: job["events"].append(dict(event, time=round(time.time(), 3))),
+                                                           layout=project["layout"], build=job["build"]))
+    try:
+        await asyncio.wait({job["task"]})  # A cancelled job must not cancel its worker, so the task is not awaited directly
+    finally:
+        if not job["task"].done():  # The daemon is shutting down
+            job["task"].cancel()
+            await asyncio.gather(job["task"], return_exceptions=True)
+        if job["task"].cancelled():
+            job["status"] = "cancelled"
+        elif job["task"].exception() is not None:
+            job.update(status="failed", error=str(job["task"].exception()))
+        else:
+            job.update(status="succeeded", directory=job["task"].result())
+        job["duration"] = round(time.time() - job["started"], 3)
+        print(f"[{job['id']}] {project['name']}: {job['status']} ({job['duration']:.2f}s)")
+        job["done"].set()
+
+async def run_daemon_worker(daemon):
+    while True:
+        job = await daemon["queue"].get()
+        if job["status"] == "queued":
+            await run_daemon_job(daemon, job)
+
+async def warm_up_daemon(template, framework, scaffold):
+    # Paid once, before the first job: the SDK probe, the golden template and a first build, which starts the compiler server
+    dotnet_environment = await asyncio.to_thread(get_dotnet_environment)
+    print(f"[daemon] Using .NET SDK {dotnet_environment['sdk_version']}")
+    if scaffold == "cache":
+        await asyncio.to_thread(get_golden_template, template, framework, None, "[daemon] ")
+    # Only the build servers need warming; --tests and --startup apply to the jobs
+    enabled_stages = (test_settings["enabled"], startup_settings["enabled"])
+    test_settings["enabled"] = startup_settings["enabled"] = False
+    try:
+        with tempfile.TemporaryDirectory(prefix="carps-warm-up-") as warm_up_directory:
+            await run_project_pipeline("CarpsWarmUp", warm_up_directory, framework=framework, log_prefix="[daemon] ", scaffold="native")
+    finally:
+        test_settings["enabled"], startup_settings["enabled"] = enabled_stages
+
+class DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "CARPS"
+
+    def log_message(self, format, *args):
+        pass  # Jobs are logged as they start and finish; every status poll would drown them out
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_json(self):
+        content_length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(content_length) or b"{}")
+
+    def get_job(self, path):
+        with self.server.carps_daemon["lock"]:
+            return self.server.carps_daemon["jobs"].get(path[len("/jobs/"):])
+
+    def check_request(self):
+        # Any local process can reach the port, so every request must carry the token from the state file
+        if not secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {self.server.carps_daemon['token']}"):
+            self.send_json(401, {"error": "Missing or wrong token."})
+            return None
+        return self.path.partition("?")
+
+    def do_GET(self):
+        request = self.check_request()
+        if request is None:
+            return
+        path, _, query = request
+        daemon = self.server.carps_daemon
+        if path == "/status":
+            with daemon["lock"]:
+                statuses = [job["status"] for job in daemon["jobs"].values()]
+            self.send_json(200, {"pid": os.getpid(), "workers": daemon["workers"], "queued": statuses.count("queued"), "running": statuses.count("running"),
+                                 "started": daemon["started"]})
+        elif path == "/jobs":
+            with daemon["lock"]:
+                jobs = [get_job_summary(job) for job in daemon["jobs"].values()]
+            self.send_json(200, {"jobs": jobs})
+        elif path.startswith("/jobs/") and self.get_job(path) is not None:
+            job = self.get_job(path)
+            try:
+                wait = float(parse_qs(query).get("wait", ["0"])[0])
+            except ValueError:
+                wait = 0
+            job["done"].wait(min(wait, JOB_WAIT_LIMIT))  # Long poll: answers as soon as the job finishes
+            self.send_json(200, get_job_summary(job))
+        else:
+            self.send_json(404, {"error": f"Not found: {path}"})
+
+    def do_POST(self):
+        request = self.check_request()
+        if request is None:
+            return
+        path = request[0]
+        daemon = self.server.carps_daemon
+        if path == "/jobs":
+            try:
+                job = make_daemon_job(self.read_json(), daemon["defaults"])
+            except ValueError as e:  # Includes malformed JSON
+                self.send_json(400, {"error": str(e)})
+                return
+            submit_daemon_job(daemon, job)
+            self.send_json(202, get_job_summary(job))
+        elif path == "/shutdown":
+            daemon["loop"].call_soon_threadsafe(daemon["stop"].set)
+            self.send_json(202, {"status": "stopping"})
+        else:
+            self.send_json(404, {"error": f"Not found: {path}"})
+
+    def do_DELETE(self):
+        request = self.check_request()
+        if request is None:
+            return
+        job = self.get_job(request[0]) if request[0].startswith("/jobs/") else None
+        if job is None:
+            self.send_json(404, {"error": f"Not found: {request[0]}"})
+            return
+        cancel_daemon_job(self.server.carps_daemon, job)
+        self.send_json(202, get_job_summary(job))
+
+async def serve_daemon(daemon, port):
+    daemon.update(loop=asyncio.get_running_loop(), queue=asyncio.Queue(), stop=asyncio.Event())
+    # Every job shares one scheduler, so concurrent jobs do not oversubscribe the cores and memory
+    heavy_step_scheduler.set(make_resource_scheduler(daemon["workers"]))
+    await warm_up_daemon(daemon["defaults"]["template"], daemon["defaults"]["framework"], daemon["defaults"]["scaffold"])
+
+    server = http.server.ThreadingHTTPServer((DAEMON_HOST, port), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.carps_daemon = daemon
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    write_daemon_state({"host": DAEMON_HOST, "port": server.server_address[1], "pid": os.getpid(), "token": daemon["token"]})
+    print(f"[daemon] Listening on http://{DAEMON_HOST}:{server.server_address[1]} with {daemon['workers']} workers")
+    workers = [asyncio.create_task(run_daemon_worker(daemon)) for _ in range(daemon["workers"])]
+    try:
+        await daemon["stop"].wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+        remove_daemon_state(daemon["token"])
+        for worker in workers:
+            worker.cancel()  # Cancels running jobs, which kills their commands
+        await asyncio.gather(*workers, return_exceptions=True)
+    print("[daemon] Stopped")
+
+def run_daemon(port=0, workers=None, template="console", framework=None, scaffold="dotnet", log_directory=None, step_timeout=None):
+    daemon = {
+        "workers": max(1, workers or os.cpu_count() or 1),
+        "defaults": {"template": template, "framework": framework, "scaffold": scaffold},
+        "log_directory": log_directory,
+        "step_timeout": step_timeout,
+        "token": secrets.token_urlsafe(32),
+        "jobs": {},
+        "lock": threading.Lock(),
+        "started": time.time(),
+    }
+    try:
+        asyncio.run(serve_daemon(daemon, port))
+    except CommandFailedError as e:
+        raise SystemExit(str(e))
+    except KeyboardInterrupt:
+        raise SystemExit("Daemon stopped. Every command it started was stopped.")
@@ -0,0 +1,136 @@
+"""
+CARPS window frontend
+
+Loaded only when CARPS is started without a project name, so the command line never pays for
+importing tkinter (and still works where Tk is not installed).
+"""
+
+
+import queue
+import threading
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+from carps_core import execute_dotnet_commands, validate_project_name
+
+STATUS_BAR_WIDTH = 80  # Characters of the latest output line shown in the GUI status bar
+GUI_EVENT_POLL_MS = 50  # How often the Tk mainloop drains events from the worker thread
+CLOSE_WAIT_SECONDS = 10  # How long closing the window waits for a cancelled job to stop its commands
+
+def animate_loading_label(loading_label):
+    dots = loading_label.cget("text").count('.')
+    if dots < 3:
+        loading_label.config(text=loading_label.cget("text") + '.')
+    else:
+        loading_label.config(text="Loading")
+
+def start_loading_animation(loading_label):
+    loading_label.place(x=250, y=100)  # Start the loading animation
+    animate_loading_label(loading_label)
+    loading_label.animation_id = loading_label.after(500, start_loading_animation, loading_label)  # Update every 500 ms
+
+def stop_loading_animation(loading_label):
+    loading_label.after_cancel(loading_label.animation_id)
+    loading_label.place_forget()  # Stop the loading animation
+
+def process_gui_events(gui_events, progress, loading_label, status_bar, run_button, progress_bar, cancel_button):
+    latest_output_line = None
+    while True:
+        try:
+            event = gui_events.get_nowait()
+        except queue.Empty:
+            break
+
+        if event["type"] == "plan":
+            progress_bar.config(maximum=len(event["steps"]), value=0)
+            progress["total"] = len(event["steps"])
+        elif event["type"] == "step-start":
+            progress["running"].append(event["step"])
+        elif event["type"] == "step-finish":
+            progress["running"].remove(event["step"])
+            progress["finished"] += 1
+            progress_bar.config(value=progress["finished"])
+        elif event["type"] == "output" and event["line"].strip():
+            latest_output_line = event["line"]
+        elif event["type"] in ("finished", "failed", "cancelled"):
+            stop_loading_animation(loading_label)
+            cancel_button.pack_forget()
+            run_button.pack(padx=10, pady=10)  # Show the button again
+            if event["type"] == "finished":
+                progress_bar.config(value=progress_bar.cget("maximum"))
+                status_bar.config(text="Done! Check the directory for your project")
+            elif event["type"] == "cancelled":
+                status_bar.config(text="Cancelled. Every command it started was stopped")
+            else:
+                status_bar.config(text="Failed. See the error message for details")
+                messagebox.showerror("Error", event["error"])
+            return  # The job is over, so stop polling
+
+    if progress["running"]:
+        step_status = f"Step {progress['finished'] + 1}/{progress['total']}: {', '.join(progress['running'])}"
+        status_bar.config(text=f"{step_status} - {latest_output_line}"[:STATUS_BAR_WIDTH] if latest_output_line else step_status)
+    status_bar.after(GUI_EVENT_POLL_MS, process_gui_events, gui_events, progress, loading_label, status_bar, run_button, progress_bar, cancel_button)
+
+def cancel_program(job, status_bar, cancel_button):
+    job["cancel_request"].set()  # The worker cancels its steps, which kills each running command's process tree
+    cancel_button.config(state=tk.DISABLED)
+    status_bar.config(text="Cancelling...")
+
+def close_window(root, job):
+    # Closing mid-run must not leave dotnet and its MSBuild nodes running behind the window
+    if job.get("thread") is not None and job["thread"].is_alive():
+        job["cancel_request"].set()
+        job["thread"].join(CLOSE_WAIT_SECONDS)
+    root.destroy()
+
+def run_program(project_name_entry, loading_label, status_bar, run_button, progress_bar, cancel_button, job):
+    project_name = project_name_entry.get()
+    try:
+        validate_project_name(project_name)
+        status_bar.config(text="Running...")
+        run_button.pack_forget()  # Hide the button
+        cancel_button.config(state=tk.NORMAL)
+        cancel_button.pack(padx=10, pady=10)
+        start_loading_animation(loading_label)
+        progress_bar.config(value=0)
+
+        gui_events = queue.Queue()
+        progress = {"total": 0, "finished": 0, "running": []}
+        job["cancel_request"] = threading.Event()
+        job["thread"] = threading.Thread(target=execute_dotnet_commands, args=(project_name, gui_events, job["cancel_request"]), daemon=True)
+        job["thread"].start()
+        process_gui_events(gui_events, progress, loading_label, status_bar, run_button, progress_bar, cancel_button)
+    except Exception as e:
+        messagebox.showerror("Error", str(e))
+
+def main():
+    root = tk.Tk()
+    root.title("CARPS - C# Automated Rapid Project Setup")
+    root.geometry("500x240")
+
+    loading_label = tk.Label(root, text="Loading", font=("Arial", 14))
+    job = {}  # The running job's worker thread and cancel request
+
+    project_name_label = tk.Label(root, text="Project Name:", font=("Arial", 14))
+    project_name_label.pack(padx=10, pady=10)  # Add padding
+
+    project_name_entry = tk.Entry(root, font=("Arial", 14))
+    project_name_entry.insert(0, "Enter project name here")  # Add default text
+    project_name_entry.pack(padx=10, pady=10)
+
+    run_button = tk.Button(root, text="Run Program", command=lambda: run_program(project_name_entry, loading_label, status_bar, run_button, progress_bar, cancel_button, job), font=("Arial", 14), bg="blue", fg="white", relief=tk.GROOVE, bd=5, highlightbackground="red", highlightcolor="green", activebackground="purple", activeforeground="yellow")
+    run_button.pack(padx=10, pady=10)
+
+    cancel_button = tk.Button(root, text="Cancel", command=lambda: cancel_program(job, status_bar, cancel_button), font=("Arial", 14))  # Shown while a job runs
+
+    clear_button = tk.Button(root, text="Clear", command=lambda: project_name_entry.delete(0, 'end'), font=("Arial", 14))  # Add clear button
+    clear_button.pack(padx=10, pady=10)
+
+    status_bar = tk.Label(root, text="Ready", bd=1, relief=tk.SUNKEN, anchor=tk.W)  # Add status bar
+    status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+
+    progress_bar = ttk.Progressbar(root, mode="determinate")  # One tick per finished step
+    progress_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
+
+    root.protocol("WM_DELETE_WINDOW", lambda: close_window(root, job))
+    root.mainloop()
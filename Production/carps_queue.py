@@ -0,0 +1,247 @@
+"""
+CARPS work queue
+
+Spreads a batch over any number of worker processes, on one machine or several, through a queue
+directory on a shared filesystem. The coordinator (CARPS.py --batch MANIFEST --queue DIR) writes
+one job file per project and collects the results; workers (CARPS.py --worker --queue DIR) claim
+jobs by renaming them, run the usual pipeline and write the results back.
+
+A claimed job's file is its lease: the worker touches it while the job runs, and a job whose file
+has not been touched for LEASE_DURATION belonged to a worker that died, so it goes back to the queue.
+"""
+
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+
+from carps_core import CommandFailedError, heavy_step_scheduler, make_resource_scheduler, scaffold_batch_project
+
+QUEUE_DIRECTORIES = ("pending", "running", "results", "clock")
+LEASE_DURATION = 60  # Seconds without a renewal after which a claimed job is handed to another worker
+LEASE_RENEW_INTERVAL = 10  # Seconds between renewals of a running job's lease, and between sweeps for expired leases
+QUEUE_POLL_INTERVAL = 0.5  # Seconds between looks for new jobs or results
+JOB_ATTEMPT_LIMIT = 3  # Claims of one job before it is reported as failed instead of being retried again
+
+def get_queue_paths(queue_directory):
+    queue_paths = {name: os.path.join(queue_directory, name) for name in QUEUE_DIRECTORIES}
+    for queue_path in queue_paths.values():
+        os.makedirs(queue_path, exist_ok=True)
+    return queue_paths
+
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def write_queue_file(file_path, data):
+    # Readers only look at *.json, so they never see a half-written file
+    temporary_path = f"{file_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as queue_file:
+        json.dump(data, queue_file, indent=2)
+    os.replace(temporary_path, file_path)
+
+def read_queue_file(file_path):
+    with open(file_path, encoding="utf-8") as queue_file:
+        return json.load(queue_file)
+
+def list_queue_files(directory_path):
+    try:
+        return sorted(name for name in os.listdir(directory_path) if name.endswith(".json"))
+    except OSError:
+        return []
+
+def get_queue_time(queue_paths, worker_id):
+    # Leases are compared with the file server's clock, which stamps every file, so hosts with skewed clocks agree on expiry
+    clock_path = os.path.join(queue_paths["clock"], worker_id)
+    with open(clock_path, "w", encoding="utf-8"):
+        pass
+    return os.stat(clock_path).st_mtime
+
+def remove_queue_clock(queue_paths, worker_id):
+    try:
+        os.remove(os.path.join(queue_paths["clock"], worker_id))
+    except OSError:
+        pass
+
+def submit_queue_jobs(queue_paths, projects, force=False):
+    # Job IDs sort in submission order, so workers take the manifest from the top and a requeued job goes back to the front
+    submit_time = int(time.time() * 1000)
+    job_ids = []
+    for index, project in enumerate(projects):
+        job_id = f"{submit_time:013d}-{index:05d}-{uuid.uuid4().hex[:8]}"
+        layout = project.get("layout")
+        if layout is not None and os.path.isfile(layout):
+            project = dict(project, layout=os.path.abspath(layout))  # Workers resolve paths from their own folders
+        write_queue_file(os.path.join(queue_paths["pending"], f"{job_id}.json"),
+                         {"id": job_id, "project": project, "force": force, "attempts": 0, "submitted": time.time(), "coordinator": get_worker_id()})
+        job_ids.append(job_id)
+    return job_ids
+
+def requeue_expired_jobs(queue_paths, worker_id):
+    queue_time = get_queue_time(queue_paths, worker_id)
+    for file_name in list_queue_files(queue_paths["running"]):
+        running_path = os.path.join(queue_paths["running"], file_name)
+        job_id, _, owner = file_name[:-len(".json")].partition("@")
+        try:
+            if queue_time - os.stat(running_path).st_mtime < LEASE_DURATION:
+                continue
+            # The rename is atomic, so only one of the workers sweeping at the same time requeues the job
+            os.rename(running_path, os.path.join(queue_paths["pending"], f"{job_id}.json"))
+        except OSError:
+            continue
+        print(f"[{worker_id}] Requeued job {job_id}: worker {owner} stopped renewing its lease")
+
+def claim_queue_job(queue_paths, worker_id):
+    for file_name in list_queue_files(queue_paths["pending"]):
+        pending_path = os.path.join(queue_paths["pending"], file_name)
+        running_path = os.path.join(queue_paths["running"], f"{file_name[:-len('.json')]}@{worker_id}.json")
+        try:
+            os.utime(pending_path)  # The rename keeps the modification time, which must start the lease and not date from submission
+            os.rename(pending_path, running_path)
+        except OSError:
+            continue  # Another worker claimed it first
+        job = read_queue_file(running_path)
+        job.update(attempts=job["attempts"] + 1, worker=worker_id, claimed=time.time())
+        write_queue_file(running_path, job)  # While the lease is renewed, only its owner writes this file
+        return job, running_path
+    return None
+
+def renew_lease(running_path):
+    try:
+        os.utime(running_path)
+        return True
+    except OSError:  # Requeued by another worker after a missed renewal: someone else may already be running the job
+        return False
+
+def release_queue_job(queue_paths, job, running_path):
+    # A worker that stops hands its jobs straight back, without counting the interrupted attempt
+    job["attempts"] -= 1
+    try:
+        write_queue_file(running_path, job)
+        os.rename(running_path, os.path.join(queue_paths["pending"], f"{job['id']}.json"))
+    except OSError:
+        pass
+
+def finish_queue_job(queue_paths, job, running_path, result):
+    write_queue_file(os.path.join(queue_paths["results"], f"{job['id']}.json"), result)
+    try:
+        os.remove(running_path)
+    except OSError:
+        pass
+
+async def run_queue_job(queue_paths, job, running_path, job_slots, worker_id, log_directory=None, step_timeout=None):
+    project = job["project"]
+    if job["attempts"] > JOB_ATTEMPT_LIMIT:
+        result = dict(project, status="failed", error=f"Gave up after {JOB_ATTEMPT_LIMIT} attempts whose workers stopped renewing their lease.",
+                      duration=0.0, cpu_time=0.0, peak_rss=0, metrics={})
+        await asyncio.to_thread(finish_queue_job, queue_paths, job, running_path, dict(result, worker=worker_id, attempts=job["attempts"]))
+        return
+    print(f"[{worker_id}] Claimed {project['name']} (attempt {job['attempts']})")
+    # The events go back with the result, so the coordinator's --json stream has the steps too
+    events = []
+    project_task = asyncio.create_task(scaffold_batch_project(project, job_slots, log_directory, step_timeout, job["force"],
+                                                              lambda event: events.append(dict(event, time=round(time.time(), 3)))))
+    try:
+        while not project_task.done():
+            await asyncio.wait({project_task}, timeout=LEASE_RENEW_INTERVAL)
+            if not project_task.done() and not await asyncio.to_thread(renew_lease, running_path):
+                print(f"[{worker_id}] Lost the lease on {project['name']}; stopping it")
+                project_task.cancel()
+                await asyncio.gather(project_task, return_exceptions=True)
+                return
+    except asyncio.CancelledError:
+        project_task.cancel()
+        while not project_task.done():  # Shutting down cancels every task, maybe twice; the job is only handed back once its commands are stopped
+            try:
+                await asyncio.wait({project_task})
+            except asyncio.CancelledError:
+                pass
+        release_queue_job(queue_paths, job, running_path)
+        raise
+    result = project_task.result()
+    await asyncio.to_thread(finish_queue_job, queue_paths, job, running_path, dict(result, worker=worker_id, attempts=job["attempts"], events=events))
+    print(f"[{worker_id}] {project['name']}: {result['status']} ({result['duration']:.1f}s)")
+
+async def run_queue_worker_async(queue_directory, jobs, log_directory=None, step_timeout=None, drain=False):
+    queue_paths = get_queue_paths(queue_directory)
+    worker_id = get_worker_id()
+    # Like a batch: the semaphore bounds the jobs this worker runs at once, and one scheduler bounds their builds
+    job_slots = asyncio.Semaphore(jobs)
+    heavy_step_scheduler.set(make_resource_scheduler(jobs))
+    running_jobs = set()
+    last_sweep_time = 0.0
+    print(f"[{worker_id}] Waiting for jobs in {queue_directory} ({jobs} at a time)")
+    try:
+        while True:
+            if time.monotonic() - last_sweep_time >= LEASE_RENEW_INTERVAL:
+                await asyncio.to_thread(requeue_expired_jobs, queue_paths, worker_id)
+                last_sweep_time = time.monotonic()
+            while len(running_jobs) < jobs:
+                claimed_job = await asyncio.to_thread(claim_queue_job, queue_paths, worker_id)
+                if claimed_job is None:
+                    break
+                running_jobs.add(asyncio.create_task(run_queue_job(queue_paths, *claimed_job, job_slots, worker_id, log_directory, step_timeout)))
+            if drain and not running_jobs and not list_queue_files(queue_paths["pending"]) and not list_queue_files(queue_paths["running"]):
+                print(f"[{worker_id}] The queue is empty; stopping")
+                break
+            if running_jobs:
+                finished_jobs, running_jobs = await asyncio.wait(running_jobs, timeout=QUEUE_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                for finished_job in finished_jobs:
+                    finished_job.result()  # Queue errors (an unreachable share) stop the worker; its jobs' leases then expire
+            else:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+    finally:
+        for running_job in running_jobs:
+            running_job.cancel()  # Stops their commands and hands the jobs back
+        await asyncio.gather(*running_jobs, return_exceptions=True)
+        remove_queue_clock(queue_paths, worker_id)
+
+def run_queue_worker(queue_directory, jobs=None, log_directory=None, step_timeout=None, drain=False):
+    try:
+        asyncio.run(run_queue_worker_async(queue_directory, max(1, jobs or os.cpu_count() or 1), log_directory, step_timeout, drain))
+    except CommandFailedError as e:
+        raise SystemExit(str(e))
+    except KeyboardInterrupt:
+        raise SystemExit("Worker stopped. Its running jobs were stopped and handed back to the queue.")
+
+def run_queued_batch(projects, queue_directory, force=False, event_callback=None):
+    queue_paths = get_queue_paths(queue_directory)
+    coordinator_id = get_worker_id()
+    job_ids = submit_queue_jobs(queue_paths, projects, force)
+    print(f"Queued {len(job_ids)} projects in {queue_directory}. Start workers with: python CARPS.py --worker --queue {queue_directory}")
+    results = {}
+    last_sweep_time = time.monotonic()
+    try:
+        while len(results) < len(job_ids):
+            time.sleep(QUEUE_POLL_INTERVAL)
+            if time.monotonic() - last_sweep_time >= LEASE_RENEW_INTERVAL:  # Also requeues when every worker has died
+                requeue_expired_jobs(queue_paths, coordinator_id)
+                last_sweep_time = time.monotonic()
+            for job_id in job_ids:
+                result_path = os.path.join(queue_paths["results"], f"{job_id}.json")
+                if job_id in results or not os.path.exists(result_path):
+                    continue
+                result = results[job_id] = read_queue_file(result_path)
+                os.remove(result_path)  # The batch report keeps the results
+                events = result.pop("events", [])
+                print(f"[{len(results)}/{len(job_ids)}] {result['name']}: {result['status']} ({result['duration']:.1f}s on {result['worker']})")
+                if event_callback is not None:
+                    for event in events:
+                        if event["type"] != "project-finish":  # Replaced by the one below, which names the worker
+                            event_callback(dict(event, worker=result["worker"]))
+                    event_callback({"type": "project-finish", "project": result["name"], "status": result["status"], "duration": result["duration"],
+                                    "directory": os.path.join(result["directory"], result["name"]), "worker": result["worker"]})
+    except KeyboardInterrupt:
+        withdrawn_count = 0
+        for job_id in job_ids:
+            try:
+                os.remove(os.path.join(queue_paths["pending"], f"{job_id}.json"))
+                withdrawn_count += 1
+            except OSError:
+                pass
+        raise SystemExit(f"Cancelled. {withdrawn_count} jobs not yet claimed were withdrawn; claimed jobs finish on their workers.")
+    finally:
+        remove_queue_clock(queue_paths, coordinator_id)
+    return [results[job_id] for job_id in job_ids]  # Manifest order
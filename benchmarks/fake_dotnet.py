@@ -0,0 +1,300 @@
+"""
+Fake `dotnet` for the CARPS benchmarks.
+
+Stands in for the .NET CLI so CARPS's own overhead can be measured on a machine without the
+.NET SDK. It understands the commands CARPS runs and writes small placeholder files for them.
+
+Behaviour is controlled with environment variables:
+- FAKE_DOTNET_STARTUP_MS: simulated CLI startup latency per invocation (default 0).
+- FAKE_DOTNET_OUTPUT_LINES: lines of output written by build-like commands (default 10).
+- FAKE_DOTNET_LINE_BYTES: length of each of those lines (default 80).
+- FAKE_DOTNET_FAILURE_RATE: probability (0-1) that a command fails (default 0).
+- FAKE_DOTNET_SEED: seed for the failure decision; the same command always gets the same outcome.
+- FAKE_DOTNET_MEMORY_MB: memory touched by build-like commands, to simulate MSBuild's footprint (default 0).
+- FAKE_DOTNET_SDK_VERSION: version reported by --version (default 8.0.100).
+- FAKE_DOTNET_TEST_MS: time each test takes in `dotnet test` (default 0). Tests whose method name contains "Fail" fail.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+import uuid
+
+SDK_VERSION = os.environ.get("FAKE_DOTNET_SDK_VERSION", "8.0.100")
+BUILD_LIKE_COMMANDS = ("build", "test", "publish", "restore")
+TEST_TEMPLATES = ("xunit", "nunit", "mstest")
+TEST_ATTRIBUTES = ("[Fact", "[Theory", "[Test", "[TestMethod")
+
+
+def get_option(arguments, *names, default=None):
+    for index, argument in enumerate(arguments[:-1]):
+        if argument in names:
+            return arguments[index + 1]
+    return default
+
+
+def write_text(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8-sig", newline="") as text_file:
+        text_file.write(text.replace("\n", "\r\n"))
+
+
+def get_target_framework(project_path):
+    try:
+        with open(project_path, encoding="utf-8-sig") as project_file:
+            match = re.search(r"<TargetFramework>([^<]+)</TargetFramework>", project_file.read())
+    except OSError:
+        match = None
+    return match.group(1) if match else f"net{SDK_VERSION.split('.')[0]}.0"
+
+
+def new_solution(arguments):
+    output_directory = get_option(arguments, "-o", "--output", default=os.getcwd())
+    name = get_option(arguments, "-n", "--name", default=os.path.basename(os.path.abspath(output_directory)))
+    write_text(os.path.join(output_directory, f"{name}.sln"),
+               "\nMicrosoft Visual Studio Solution File, Format Version 12.00\nGlobal\nEndGlobal\n")
+    print('The template "Solution File" was created successfully.')
+
+
+def new_project(template, arguments):
+    output_directory = get_option(arguments, "-o", "--output", default=os.getcwd())
+    name = get_option(arguments, "-n", "--name", default=os.path.basename(os.path.abspath(output_directory)))
+    framework = get_option(arguments, "-f", "--framework", default=f"net{SDK_VERSION.split('.')[0]}.0")
+    output_type = "<OutputType>Exe</OutputType>\n    " if template == "console" else ""
+    write_text(os.path.join(output_directory, f"{name}.csproj"),
+               f'<Project Sdk="Microsoft.NET.Sdk">\n\n  <PropertyGroup>\n    {output_type}<TargetFramework>{framework}</TargetFramework>\n'
+               "  </PropertyGroup>\n\n</Project>\n")
+    if template == "console":
+        write_text(os.path.join(output_directory, "Program.cs"), 'Console.WriteLine("Hello, World!");\n')
+    elif template in TEST_TEMPLATES:
+        write_text(os.path.join(output_directory, "UnitTest1.cs"),
+                   f"namespace {name};\n\npublic class UnitTest1\n{{\n    [Fact]\n    public void Test1()\n    {{\n    }}\n}}\n")
+    else:
+        write_text(os.path.join(output_directory, "Class1.cs"), f"namespace {name};\n\npublic class Class1\n{{\n}}\n")
+    print(f'The template "{template}" was created successfully.')
+
+
+def add_to_solution(arguments):
+    solution_path = arguments[0]
+    with open(solution_path, encoding="utf-8-sig") as solution_file:
+        solution_text = solution_file.read()
+    for project_path in arguments[2:]:
+        name = os.path.splitext(os.path.basename(project_path))[0]
+        relative_path = os.path.relpath(project_path, os.path.dirname(solution_path)).replace("/", "\\")
+        solution_text = solution_text.replace(
+            "Global\n",
+            f'Project("{{FAE04EC0-301F-11D3-BF4B-00C04F79EFBC}}") = "{name}", "{relative_path}", "{{{str(uuid.uuid4()).upper()}}}"\nEndProject\nGlobal\n', 1)
+        print(f"Project `{relative_path}` added to the solution.")
+    write_text(solution_path, solution_text)
+
+
+def find_project(arguments):
+    for argument in arguments:
+        if argument.endswith((".csproj", ".sln")):
+            return argument
+    project_files = [name for name in os.listdir(os.getcwd()) if name.endswith(".csproj")]
+    return os.path.join(os.getcwd(), project_files[0]) if project_files else None
+
+
+def build(arguments):
+    project_path = find_project(arguments)
+    if project_path and project_path.endswith(".sln"):
+        with open(project_path, encoding="utf-8-sig") as solution_file:
+            for relative_path in re.findall(r'^Project\("[^"]*"\) = "[^"]*", "([^"]+\.csproj)"', solution_file.read(), re.MULTILINE):
+                build([os.path.join(os.path.dirname(project_path), relative_path.replace("\\", os.sep))])
+    elif project_path and project_path.endswith(".csproj"):
+        name = os.path.splitext(os.path.basename(project_path))[0]
+        output_directory = os.path.join(os.path.dirname(project_path), "bin", "Debug", get_target_framework(project_path))
+        os.makedirs(output_directory, exist_ok=True)
+        os.makedirs(os.path.join(os.path.dirname(project_path), "obj"), exist_ok=True)
+        with open(os.path.join(output_directory, f"{name}.dll"), "wb") as assembly_file:
+            assembly_file.write(b"MZ fake assembly")
+
+
+def publish(arguments):
+    project_path = find_project(arguments)
+    name = os.path.splitext(os.path.basename(project_path))[0]
+    output_directory = get_option(arguments, "-o", "--output",
+                                  default=os.path.join(os.path.dirname(project_path), "bin", "Release", get_target_framework(project_path), "publish"))
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, f"{name}.dll"), "wb") as assembly_file:
+        assembly_file.write(b"MZ fake assembly")  # No app host, so it is launched as `dotnet <name>.dll`
+
+
+def find_tests(project_directory):
+    tests = []
+    for root_directory, directory_names, file_names in os.walk(project_directory):
+        directory_names[:] = sorted(name for name in directory_names if name not in ("bin", "obj"))
+        for file_name in sorted(name for name in file_names if name.endswith(".cs")):
+            namespace, class_name, is_test = None, None, False
+            with open(os.path.join(root_directory, file_name), encoding="utf-8-sig") as source_file:
+                for line in source_file:
+                    namespace_match = re.match(r"\s*namespace\s+([\w.]+)", line)
+                    class_match = re.search(r"\bclass\s+(\w+)", line)
+                    method_match = re.search(r"\bvoid\s+(\w+)\s*\(", line)
+                    if namespace_match:
+                        namespace = namespace_match.group(1)
+                    elif class_match:
+                        class_name = f"{namespace}.{class_match.group(1)}" if namespace else class_match.group(1)
+                    elif line.strip().startswith(TEST_ATTRIBUTES):
+                        is_test = True
+                    elif is_test and method_match:
+                        tests.append((class_name, method_match.group(1)))
+                        is_test = False
+    return tests
+
+
+def matches_test_filter(test_filter, full_name):
+    # The part of dotnet test's filter syntax CARPS uses: FullyQualifiedName with = != ~ !~, & and |, parentheses and \ escapes
+    tokens = re.findall(r"(?:\\.|[^\\()&|])+|[()&|]", test_filter)
+    position = 0
+
+    def parse_any():
+        nonlocal position
+        value = parse_all()
+        while position < len(tokens) and tokens[position] == "|":
+            position += 1
+            value = parse_all() or value
+        return value
+
+    def parse_all():
+        nonlocal position
+        value = parse_term()
+        while position < len(tokens) and tokens[position] == "&":
+            position += 1
+            value = parse_term() and value
+        return value
+
+    def parse_term():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        if token == "(":
+            value = parse_any()
+            position += 1  # The closing parenthesis
+            return value
+        _, operator, value = re.match(r"\s*(\w+)\s*(!=|!~|=|~)(.*)", token).groups()
+        value = re.sub(r"\\(.)", r"\1", value).strip()
+        return {"=": full_name == value, "!=": full_name != value, "~": value in full_name, "!~": value not in full_name}[operator]
+
+    return parse_any()
+
+
+def format_trx_duration(seconds):
+    return f"{int(seconds // 3600):02}:{int(seconds % 3600 // 60):02}:{seconds % 60:010.7f}"
+
+
+def write_trx(trx_path, results):
+    now = time.strftime("%Y-%m-%dT%H:%M:%S.0000000+00:00", time.gmtime())
+    unit_test_results, unit_tests, test_entries = [], [], []
+    for class_name, method_name, outcome, duration in results:
+        test_id, execution_id = uuid.uuid4(), uuid.uuid4()
+        error_info = f"<Output><ErrorInfo><Message>Assert.True() Failure</Message><StackTrace>at {class_name}.{method_name}()</StackTrace></ErrorInfo></Output>" if outcome == "Failed" else ""
+        unit_test_results.append(f'    <UnitTestResult executionId="{execution_id}" testId="{test_id}" testName="{class_name}.{method_name}" computerName="fake" '
+                                 f'duration="{format_trx_duration(duration)}" startTime="{now}" endTime="{now}" testType="13cdc9d9-ddb5-4fa4-a97d-d965ccfc6d4b" '
+                                 f'outcome="{outcome}" testListId="8c84fa94-04c1-424b-9868-57a2d4851a1d">{error_info}</UnitTestResult>')
+        unit_tests.append(f'    <UnitTest name="{class_name}.{method_name}" storage="fake.dll" id="{test_id}"><Execution id="{execution_id}" />'
+                          f'<TestMethod codeBase="fake.dll" adapterTypeName="executor://fake" className="{class_name}" name="{method_name}" /></UnitTest>')
+        test_entries.append(f'    <TestEntry testId="{test_id}" executionId="{execution_id}" testListId="8c84fa94-04c1-424b-9868-57a2d4851a1d" />')
+    failed = sum(1 for result in results if result[2] == "Failed")
+    write_text(trx_path, "\n".join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        f'<TestRun id="{uuid.uuid4()}" name="fake" xmlns="http://microsoft.com/schemas/VisualStudio/TeamTest/2010">',
+        f'  <Times creation="{now}" queuing="{now}" start="{now}" finish="{now}" />',
+        "  <Results>", *unit_test_results, "  </Results>",
+        "  <TestDefinitions>", *unit_tests, "  </TestDefinitions>",
+        "  <TestEntries>", *test_entries, "  </TestEntries>",
+        f'  <ResultSummary outcome="{"Failed" if failed else "Completed"}">',
+        f'    <Counters total="{len(results)}" executed="{len(results)}" passed="{len(results) - failed}" failed="{failed}" error="0" timeout="0" aborted="0" />',
+        "  </ResultSummary>",
+        "</TestRun>", ""]))
+
+
+def run_tests(arguments):
+    project_path = find_project(arguments)
+    test_filter = get_option(arguments, "--filter")
+    if "--list-tests" in arguments:
+        print("The following Tests are available:")
+        for class_name, method_name in find_tests(os.path.dirname(project_path)):
+            print(f"    {class_name}.{method_name}")
+        return 0
+    test_seconds = float(os.environ.get("FAKE_DOTNET_TEST_MS", "0")) / 1000
+    results = []
+    for class_name, method_name in find_tests(os.path.dirname(project_path)):
+        if test_filter is None or matches_test_filter(test_filter, f"{class_name}.{method_name}"):
+            time.sleep(test_seconds)
+            results.append((class_name, method_name, "Failed" if "Fail" in method_name else "Passed", test_seconds))
+    logger = get_option(arguments, "--logger", "-l", default="")
+    if logger.startswith("trx"):
+        log_file_name = dict(option.split("=", 1) for option in logger.split(";")[1:] if "=" in option).get("LogFileName", "fake.trx")
+        write_trx(os.path.join(get_option(arguments, "--results-directory", default="TestResults"), log_file_name), results)
+    if not results:
+        print(f"No test matches the given testcase filter `{test_filter}` in {project_path}")
+        return 0
+    failed = sum(1 for result in results if result[2] == "Failed")
+    print(f"{'Failed' if failed else 'Passed'}!  - Failed: {failed:>5}, Passed: {len(results) - failed:>5}, Skipped: {0:>5}, Total: {len(results):>5}")
+    return 1 if failed else 0
+
+
+def write_build_output():
+    line_count = int(os.environ.get("FAKE_DOTNET_OUTPUT_LINES", "10"))
+    line_bytes = int(os.environ.get("FAKE_DOTNET_LINE_BYTES", "80"))
+    memory = bytearray(int(float(os.environ.get("FAKE_DOTNET_MEMORY_MB", "0")) * 1024 * 1024))
+    for page in range(0, len(memory), 4096):
+        memory[page] = 1  # Touch every page so it counts towards the resident set
+    padding = "." * max(0, line_bytes - 30)
+    write = sys.stdout.write
+    for line_number in range(line_count):
+        write(f"  Compiling item {line_number:>8} {padding}\n")
+
+
+def main(arguments):
+    startup_milliseconds = float(os.environ.get("FAKE_DOTNET_STARTUP_MS", "0"))
+    if startup_milliseconds:
+        time.sleep(startup_milliseconds / 1000)
+
+    failure_rate = float(os.environ.get("FAKE_DOTNET_FAILURE_RATE", "0"))
+    if failure_rate and random.Random(f"{os.environ.get('FAKE_DOTNET_SEED', '0')}:{' '.join(arguments)}").random() < failure_rate:
+        print(f"error FAKE0001: simulated failure of dotnet {' '.join(arguments)}")
+        return 1
+
+    if not arguments or arguments[0] in ("--version", "--info"):
+        print(SDK_VERSION)
+    elif arguments[0] == "--list-sdks":
+        print(f"{SDK_VERSION} [{os.path.dirname(os.path.abspath(__file__))}]")
+    elif arguments[0].endswith(".dll"):
+        print("Hello, World!")
+    elif arguments[0] == "new" and len(arguments) > 1:
+        if arguments[1] == "sln":
+            new_solution(arguments[2:])
+        elif arguments[1] in ("list", "--list"):
+            # Same table layout as the real CLI, which CARPS parses in its environment probe
+            print("Template Name        Short Name  Language    Tags")
+            print("-------------------  ----------  ----------  --------------")
+            for template_name, short_name, tags in (("Console App", "console", "Common/Console"), ("Class Library", "classlib", "Common/Library"),
+                                                    ("xUnit Test Project", "xunit", "Test/xUnit"), ("Solution File", "sln", "Solution")):
+                print(f"{template_name:<19}  {short_name:<10}  {'[C#]':<10}  {tags}")
+        else:
+            new_project(arguments[1], arguments[2:])
+    elif arguments[0] == "sln":
+        add_to_solution(arguments[1:])
+    elif arguments[0] in BUILD_LIKE_COMMANDS:
+        write_build_output()
+        if arguments[0] == "build":
+            build(arguments[1:])
+        elif arguments[0] == "test":
+            return run_tests(arguments[1:])
+        elif arguments[0] == "publish":
+            publish(arguments[1:])
+        print("Build succeeded.")
+    elif arguments[0] == "run":
+        if "--no-build" not in arguments:
+            write_build_output()
+        print("Hello, World!")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,306 @@
+"""
+CARPS orchestration benchmarks
+
+Measures CARPS's own overhead by running it against the fake `dotnet` in benchmarks/fake_dotnet,
+so no .NET SDK is needed and the numbers are comparable across runs and CARPS versions.
+
+Benchmarks:
+- spawn: cost of one command through execute_single_command compared with a bare subprocess.run.
+- large_log: throughput and Python memory while streaming a very large build log.
+- gui_events: latency from the GUI worker publishing an event to the Tk poll loop draining it.
+- batch: wall time of a batch of projects for increasing --jobs values.
+- pipeline: end-to-end time of one project for each scaffold mode.
+- startup: interpreter start-up and import time of `CARPS.py --help`, checked against a budget; also fails if
+  the command-line path imports tkinter.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--output results.json] [--compare baseline.json]
+
+With --compare, every metric is checked against the baseline file and the script exits with a
+non-zero status if any of them got slower (or bigger) by more than --tolerance percent. The startup
+benchmark also fails on its own when it goes over --startup-budget milliseconds.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import queue
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FAKE_DOTNET_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "fake_dotnet")
+PRODUCTION_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "..", "Production")
+sys.path.insert(0, PRODUCTION_DIRECTORY)
+
+import carps_core  # noqa: E402
+
+FULL_SETTINGS = {"spawn_count": 50, "log_lines": 500000, "batch_projects": 16, "batch_jobs": [1, 2, 4, 8], "startup_ms": 100, "startup_runs": 20}
+QUICK_SETTINGS = {"spawn_count": 10, "log_lines": 50000, "batch_projects": 8, "batch_jobs": [1, 4], "startup_ms": 50, "startup_runs": 5}
+STARTUP_BUDGET_MS = 250  # Wall time of `python CARPS.py --help`, interpreter start-up included
+
+
+def use_fake_dotnet(**fake_settings):
+    os.environ["FAKE_DOTNET_PYTHON"] = sys.executable
+    if not os.environ["PATH"].startswith(FAKE_DOTNET_DIRECTORY + os.pathsep):
+        os.environ["PATH"] = FAKE_DOTNET_DIRECTORY + os.pathsep + os.environ["PATH"]
+    for name in ("STARTUP_MS", "OUTPUT_LINES", "LINE_BYTES", "FAILURE_RATE", "MEMORY_MB"):
+        os.environ.pop(f"FAKE_DOTNET_{name}", None)
+    for name, value in fake_settings.items():
+        os.environ[f"FAKE_DOTNET_{name.upper()}"] = str(value)
+
+
+@contextlib.contextmanager
+def quiet_working_directory():
+    # CARPS prints every output line; the console itself is not what is being measured
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="carps-bench-") as working_directory, \
+            open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        os.chdir(working_directory)
+        try:
+            yield working_directory
+        finally:
+            os.chdir(previous_directory)
+
+
+def benchmark_spawn(settings):
+    use_fake_dotnet()
+    fake_dotnet = os.path.join(FAKE_DOTNET_DIRECTORY, "dotnet")
+    count = settings["spawn_count"]
+
+    # Medians of individual calls, so one slow spawn on a busy machine does not skew the result
+    raw_timings = []
+    for _ in range(count):
+        start_time = time.perf_counter()
+        subprocess.run([fake_dotnet, "--version"], stdout=subprocess.DEVNULL, check=True)
+        raw_timings.append(time.perf_counter() - start_time)
+    raw_milliseconds = statistics.median(raw_timings) * 1000
+
+    async def run_commands():
+        timings = []
+        for _ in range(count):
+            start_time = time.perf_counter()
+            await carps_core.execute_single_command(["dotnet", "--version"])
+            timings.append(time.perf_counter() - start_time)
+        return timings
+
+    with quiet_working_directory():
+        carps_milliseconds = statistics.median(asyncio.run(run_commands())) * 1000
+
+    return {"raw_ms": raw_milliseconds, "carps_ms": carps_milliseconds, "overhead_ms": carps_milliseconds - raw_milliseconds}
+
+
+def benchmark_large_log(settings):
+    use_fake_dotnet(output_lines=settings["log_lines"], line_bytes=120)
+    with quiet_working_directory():
+        start_time = time.perf_counter()
+        asyncio.run(carps_core.execute_single_command(["dotnet", "build"]))
+        seconds = time.perf_counter() - start_time
+
+        # Separate run: tracemalloc slows allocation down too much to time the same run
+        tracemalloc.start()
+        asyncio.run(carps_core.execute_single_command(["dotnet", "build"]))
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "lines": settings["log_lines"],
+        "seconds": seconds,
+        "lines_per_second": settings["log_lines"] / seconds,
+        "peak_python_memory_mb": peak_bytes / (1024 * 1024),
+    }
+
+
+class TimedQueue(queue.Queue):
+    def put(self, item, block=True, timeout=None):
+        super().put((time.perf_counter(), item), block, timeout)
+
+
+def benchmark_gui_events(settings):
+    import carps_gui  # Only this benchmark needs tkinter
+    use_fake_dotnet(startup_ms=20, output_lines=200)
+    latencies = []
+    with quiet_working_directory():
+        gui_events = TimedQueue()
+        worker = threading.Thread(target=carps_core.execute_dotnet_commands, args=("GuiBench", gui_events))
+        worker.start()
+        finished = False
+        while not finished:
+            # The same poll interval the Tk mainloop uses in process_gui_events
+            time.sleep(carps_gui.GUI_EVENT_POLL_MS / 1000)
+            while True:
+                try:
+                    published, event = gui_events.get_nowait()
+                except queue.Empty:
+                    break
+                latencies.append((time.perf_counter() - published) * 1000)
+                finished = finished or event["type"] in ("finished", "failed")
+        worker.join()
+
+    latencies.sort()
+    return {
+        "events": len(latencies),
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "max_ms": latencies[-1],
+    }
+
+
+def benchmark_batch(settings):
+    use_fake_dotnet(startup_ms=settings["startup_ms"])
+    results = {}
+    for jobs in settings["batch_jobs"]:
+        with quiet_working_directory() as working_directory:
+            projects = [{"name": f"Batch{index}", "directory": working_directory, "template": "console", "framework": None, "scaffold": "dotnet"}
+                        for index in range(settings["batch_projects"])]
+            start_time = time.perf_counter()
+            batch_results = carps_core.run_batch(projects, jobs)
+            results[f"jobs_{jobs}_seconds"] = time.perf_counter() - start_time
+            if any(result["status"] != "succeeded" for result in batch_results):
+                raise RuntimeError(f"Batch benchmark failed with {jobs} jobs")
+    first_jobs, last_jobs = settings["batch_jobs"][0], settings["batch_jobs"][-1]
+    results["speedup"] = results[f"jobs_{first_jobs}_seconds"] / results[f"jobs_{last_jobs}_seconds"]
+    return results
+
+
+def benchmark_pipeline(settings):
+    use_fake_dotnet(startup_ms=settings["startup_ms"])
+    results = {}
+    for scaffold in carps_core.SCAFFOLD_MODES:
+        with quiet_working_directory():
+            carps_core.console_execute_dotnet_commands("WarmUp", scaffold=scaffold)  # Fills the template cache
+            start_time = time.perf_counter()
+            carps_core.console_execute_dotnet_commands("Pipeline", scaffold=scaffold)
+            results[f"{scaffold}_seconds"] = time.perf_counter() - start_time
+    return results
+
+
+def benchmark_startup(settings):
+    entry_point = os.path.join(PRODUCTION_DIRECTORY, "CARPS.py")
+    wall_timings = []
+    for _ in range(settings["startup_runs"]):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, entry_point, "--help"], stdout=subprocess.DEVNULL, check=True)
+        wall_timings.append(time.perf_counter() - start_time)
+
+    # -X importtime reports every module on stderr as "import time: self | cumulative | name"
+    import_report = subprocess.run([sys.executable, "-X", "importtime", entry_point, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, check=True).stderr
+    imported_modules = {}
+    for line in import_report.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match and not match.group(2):  # Top-level imports only; their cumulative times already include their children
+            imported_modules[match.group(3)] = int(match.group(1)) / 1000
+    if any(module_name.startswith(("tkinter", "_tkinter", "carps_gui")) for module_name in re.findall(r"\| *(\S+)$", import_report, re.MULTILINE)):
+        raise RuntimeError("The command-line path imported tkinter")
+
+    return {
+        "wall_ms": statistics.median(wall_timings) * 1000,
+        "import_ms": sum(imported_modules.values()),
+        "carps_import_ms": imported_modules.get("carps_cli", 0.0),
+    }
+
+
+BENCHMARKS = {
+    "spawn": benchmark_spawn,
+    "large_log": benchmark_large_log,
+    "gui_events": benchmark_gui_events,
+    "batch": benchmark_batch,
+    "pipeline": benchmark_pipeline,
+    "startup": benchmark_startup,
+}
+
+# Metrics where a higher value is better; every other metric is a cost
+HIGHER_IS_BETTER = ("lines_per_second", "speedup")
+# Metrics that describe the run rather than measure it
+NOT_COMPARED = ("lines", "events", "raw_ms")
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline, tolerance):
+    if baseline["meta"]["settings"] != results["meta"]["settings"]:
+        print("Warning: the baseline was recorded with different settings; numbers may not be comparable.")
+
+    regressions = []
+    print(f"\n{'metric':<36}{'baseline':>12}{'current':>12}{'change':>9}")
+    for benchmark_name, metrics in results["results"].items():
+        for metric_name, value in metrics.items():
+            baseline_value = baseline["results"].get(benchmark_name, {}).get(metric_name)
+            if baseline_value is None or metric_name in NOT_COMPARED or not baseline_value:
+                continue
+            change = (value - baseline_value) / abs(baseline_value) * 100
+            worse = -change if metric_name in HIGHER_IS_BETTER else change
+            marker = "  REGRESSION" if worse > tolerance else ""
+            print(f"{benchmark_name + '.' + metric_name:<36}{baseline_value:>12.3f}{value:>12.3f}{change:>8.1f}%{marker}")
+            if marker:
+                regressions.append(f"{benchmark_name}.{metric_name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CARPS's orchestration overhead with a fake dotnet.")
+    parser.add_argument("--quick", action="store_true", help="Use smaller sizes for a fast smoke run.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks.")
+    parser.add_argument("--output", metavar="PATH", help="Write the results to a JSON file.")
+    parser.add_argument("--compare", metavar="PATH", help="Compare with a results file from an earlier run.")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="Allowed regression in percent when comparing (default: 20).")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, metavar="MS",
+                        help=f"Fail if `CARPS.py --help` takes longer than this many milliseconds (default: {STARTUP_BUDGET_MS}).")
+    args = parser.parse_args()
+
+    if os.name == "nt":
+        raise SystemExit("The fake dotnet launcher is a POSIX shell script; run the benchmarks on Linux or macOS.")
+
+    settings = QUICK_SETTINGS if args.quick else FULL_SETTINGS
+    os.environ["CARPS_CACHE_DIR"] = tempfile.mkdtemp(prefix="carps-bench-cache-")  # Never touch the real template cache
+    results = {
+        "meta": {
+            "carps_revision": get_git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": settings,
+        },
+        "results": {},
+    }
+
+    for benchmark_name, benchmark in BENCHMARKS.items():
+        if args.only and benchmark_name not in args.only:
+            continue
+        print(f"Running {benchmark_name}...", flush=True)
+        results["results"][benchmark_name] = benchmark(settings)
+        for metric_name, value in results["results"][benchmark_name].items():
+            print(f"  {metric_name:<28}{value:>12.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    startup_ms = results["results"].get("startup", {}).get("wall_ms")
+    if startup_ms is not None and startup_ms > args.startup_budget:
+        raise SystemExit(f"Start-up took {startup_ms:.0f} ms, over the {args.startup_budget:.0f} ms budget.")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} metrics regressed by more than {args.tolerance}%: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()